@@ -1,7 +1,7 @@
 import sound
 
 import pygame
-# import sys
+import sys
 import os
 import math
 
@@ -10,10 +10,15 @@ import utility
 import constants
 import events
 import player
-import levels
+import level_registry
 import ripples
+import view
+import visibility_field
 
 import debug
+import dirty_rects
+import frame_timing
+import frame_trace
 
 os.environ['SDL_VIDEO_CENTERED'] = '1'
 
@@ -71,6 +76,10 @@ level_offset = (0, 50)
 zoomed_ripples = ripples.RippleHandler()
 unzoomed_ripples = ripples.RippleHandler()
 
+panorama = view.Panorama()
+level_layer = view.LevelLayer()
+precomputed_view = visibility_field.load()
+
 
 def create_debug_mode_file():
     file = open("Debug Mode.txt", "w+")
@@ -87,30 +96,36 @@ else:
     create_debug_mode_file()
     debug_mode = False
 
+frame_timing.enabled = debug_mode
+frame_trace.enabled = "--trace" in sys.argv
+
 
 def screen_update(fps):
-    pygame.display.flip()
-    final_display.fill(constants.WHITE)
+    frame_timing.phase("flip")
+    dirty_rects.present()
+    frame_timing.phase("other")
+    dirty_rects.clear(final_display)
+    frame_timing.end_frame()
     clock.tick(fps)
 
 
 FOV = player.FOV
 
 
-def new_ray(position, level, angle):
-    segment = geometry.closest_wall_level(position, level, angle)
+def debug_rays(position, level, angles):
+    """Draws a debug line for every ray in angles, from the player to
+    whatever the ray hits.
+    """
+    hits = level.rays.cast_all(position, angles)
 
-    if segment:
-        color = segment.color
-        if debug_mode:
-            debug_point_1 = geometry.closest_wall_level_intersection(position, level, angle)
-            debug_point_1 = utility.add_tuples(debug_point_1, level_offset)
+    for angle, hit in zip(angles, hits):
+        if hit:
+            color = hit.color
+            debug_point_1 = utility.add_tuples(hit.point, level_offset)
             debug_point_2 = player_entity.position
             debug_point_2 = utility.add_tuples(debug_point_2, level_offset)
             debug.new_line(debug_point_1, debug_point_2, color)
-    else:
-        color = constants.WHITE
-        if debug_mode:
+        else:
             debug_point_1 = geometry.screen_edge(position, angle)
             if debug_point_1:
                 debug_point_1 = utility.add_tuples(debug_point_1, level_offset)
@@ -118,10 +133,13 @@ def new_ray(position, level, angle):
                 debug_point_2 = utility.add_tuples(debug_point_2, level_offset)
                 debug.new_line(debug_point_1, debug_point_2, BLACK)
 
-    return angle, color
-
 
 def debug_collision():
+    # Circle collision uses the walls themselves, which are already drawn
+    if player.collision_mode == player.CIRCLE_COLLISION:
+        return
+
+    play_screen.level.build_player_collision()
     for segment in play_screen.level.player_collision:
         point_1 = utility.add_tuples(segment.point1, level_offset)
         point_2 = utility.add_tuples(segment.point2, level_offset)
@@ -129,8 +147,6 @@ def debug_collision():
 
 
 def draw_view(surface, y):
-    rays = []
-
     position = player_entity.position
     level = play_screen.level
 
@@ -143,83 +159,17 @@ def draw_view(surface, y):
     # to a wall
     # Bug: Fixed!  By making it so that the player can't go too close to walls,
     # it is literally impossible to experience this effect anymore.
-    for polygon in play_screen.level.collision:
-        for point in polygon.point_list:
-            angle = geometry.angle_between(position, point)
-            rays.append(new_ray(position, level, angle - 0.00001))
-            rays.append(new_ray(position, level, angle))
-            rays.append(new_ray(position, level, angle + 0.00001))
-
-    rays.sort()  # sorts rays by their angle
-
-    lowest_angle = player_entity.angle - (FOV / 2.0)
-    highest_angle = player_entity.angle + (FOV / 2.0)
-
-    first_index = 0
-    lowest_difference = 10.0
-    for index, ray in enumerate(rays):
-        angle = ray[0]
-        while angle < lowest_angle:
-            angle += math.pi * 2
-        difference = angle - lowest_angle
-        if difference < lowest_difference:
-            lowest_difference = difference
-            first_index = index
-
-        while angle < lowest_angle + math.pi * 2:
-            angle += math.pi * 2
-        difference = angle - (lowest_angle + math.pi * 2)
-        if difference < lowest_difference:
-            lowest_difference = difference
-            first_index = index
-
-    previous_x = 0
-    previous_index = first_index - 1
-
-    current_index = first_index
-
-    # range(1000) rather than while True to prevent freezing.  If a level
-    # somehow has more than 166 segments, increase this number
-    for _ in range(1000):
-        if rays[current_index][1] != rays[previous_index][1]:
-            current_angle = rays[current_index - 1][0]
-            if current_angle > lowest_angle + math.pi * 2:
-                current_x = current_angle - (lowest_angle + math.pi * 2)
-            elif current_angle > lowest_angle:
-                current_x = current_angle - lowest_angle
-            else:
-                current_x = current_angle + math.pi * 2 - lowest_angle
-            current_x /= (FOV / constants.SCREEN_WIDTH)
-            current_x = int(current_x)
+    spans = panorama.update(level, position)
 
-            color = rays[previous_index][1]
-            if color != constants.WHITE:
-                width = current_x - previous_x
-                surface.fill(color, (previous_x, y, width, 20))
-
-            previous_x = current_x
-            previous_index = current_index
-
-        current_index += 1
-        if current_index >= len(rays):
-            current_index = 0
+    if debug_mode:
+        angles = []
+        for start_angle, end_angle, color in spans:
+            angles.append(start_angle + 0.00001)
+            angles.append(end_angle - 0.00001)
+        debug_rays(position, level, angles)
 
-        if current_index == first_index:
-            break
-
-        if lowest_angle > highest_angle:
-            normal_check = highest_angle < rays[current_index][0] < lowest_angle
-        elif lowest_angle < -math.pi:
-            normal_check = highest_angle < rays[current_index][0] < lowest_angle + math.pi * 2
-        else:
-            normal_check = highest_angle < rays[current_index][0]
-        modded_check = highest_angle - math.pi * 2 < rays[current_index][0] < lowest_angle
-        if normal_check or modded_check:
-            color = rays[current_index - 1][1]
-            if color != constants.WHITE:
-                width = constants.SCREEN_WIDTH - previous_x
-                surface.fill(color, (previous_x, y, width, 20))
-            break
+    panorama.draw(surface, y, player_entity.angle - (FOV / 2.0))
+    dirty_rects.add(pygame.Rect(0, y, constants.SCREEN_WIDTH, view.HEIGHT))
 
 
 class TutorialText:
@@ -229,12 +179,8 @@ class TutorialText:
         self.string = string
 
     def draw(self, surface, alpha=255):
-        if alpha == 255:
-            text = small_font_dark.render(self.string, True, BLACK)
-        else:
-            text = utility.black_text_alpha(small_font_dark, self.string, alpha)
-
-        surface.blit(text, self.position)
+        text = utility.black_text_alpha(small_font_dark, self.string, alpha)
+        return surface.blit(text, self.position)
 
 
 class Signal:
@@ -249,14 +195,17 @@ class Signal:
         self.x = position[0]
         self.y = position[1]
 
-        for polygon in level.goals:
-            if geometry.point_in_polygon(position, polygon):
-                if polygon.color in utility.saturated_counterpart:
-                    self.color = utility.saturated_counterpart[polygon.color]
-                else:
-                    self.color = BLACK
-                self.satisfied = True
-                break
+        # The indices of the goals the signal is in.  Usually just one, but
+        # a signal right on a corner that two goals share is in both.
+        self.goals = level.goal_mask.all_indices_at(position)
+
+        if self.goals:
+            polygon = level.goals[self.goals[0]]
+            if polygon.color in utility.saturated_counterpart:
+                self.color = utility.saturated_counterpart[polygon.color]
+            else:
+                self.color = BLACK
+            self.satisfied = True
 
         else:
             self.color = BLACK
@@ -677,8 +626,13 @@ class PlayScreen:
                     sound.volume_control.fade_to(value)
 
     def draw(self, surface):
+        frame_timing.phase("level")
+        zooming = self.verdicting or self.drama_pausing or self.resulting
+        if zooming or self.level_num > last_level or self.alpha < 255 or self.pause_alpha != 0:
+            dirty_rects.refresh(surface)
+
         if self.level_num <= last_level:
-            if self.verdicting or self.drama_pausing or self.resulting:
+            if zooming:
                 level_surface = self.zoom_temp
                 self.zoom_temp.fill(constants.WHITE)
 
@@ -686,20 +640,22 @@ class PlayScreen:
                 level_surface = surface
 
             if self.tutorial_stage == 3 and not self.changing_tutorial_stage:
-                self.level.draw_debug_goals(level_surface, level_offset, self.text_alpha)
-            elif self.tutorial_stage == 3 and self.changing_tutorial_stage:
-                self.level.draw_debug_goals(level_surface, level_offset)
-            elif self.tutorial_stage > 3:
-                self.level.draw_debug_goals(level_surface, level_offset)
+                goal_alpha = self.text_alpha
+            elif self.tutorial_stage >= 3:
+                goal_alpha = 255
+            else:
+                goal_alpha = None
 
-            self.level.draw_debug_outline(level_surface, level_offset)
+            if level_layer.update(self.level, level_offset, goal_alpha):
+                dirty_rects.refresh(surface)
+            level_layer.draw(level_surface)
 
             if self.show_circles and self.previous_signals:
                 for signal in self.previous_signals:
                     color = signal.color
                     position = utility.int_tuple(signal.position)
                     position = utility.add_tuples(position, level_offset)
-                    pygame.draw.circle(level_surface, color, position, Signal.RADIUS)
+                    dirty_rects.add(pygame.draw.circle(level_surface, color, position, Signal.RADIUS))
 
             tutorial_show = self.tutorial_stage == 3 or self.tutorial_stage == 4
             win_show = self.won and not self.verdicting and not self.drama_pausing
@@ -708,27 +664,36 @@ class PlayScreen:
                     color = signal.color
                     position = utility.int_tuple(signal.position)
                     position = utility.add_tuples(position, level_offset)
-                    pygame.draw.circle(level_surface, color, position, Signal.RADIUS)
+                    dirty_rects.add(pygame.draw.circle(level_surface, color, position, Signal.RADIUS))
 
             if self.show_player:
-                player_entity.draw_debug(level_surface, play_screen.level, level_offset)
-
-            zoomed_ripples.draw(self.zoom_temp)
-
-            if self.verdicting or self.drama_pausing or self.resulting:
-                width = int(self.zoom * constants.SCREEN_WIDTH)
-                height = int(self.zoom * constants.SCREEN_HEIGHT)
-                zoom_surface = pygame.transform.scale(self.zoom_temp, (width, height))
-                x = -(width - constants.SCREEN_WIDTH) // 2
-                y = -(height - constants.SCREEN_HEIGHT) // 2
-                surface.blit(zoom_surface, (x, y))
-
+                dirty_rects.add(*player_entity.draw_debug(level_surface, play_screen.level, level_offset))
+
+            # zoom_temp is only on screen while zooming
+            if zooming:
+                frame_timing.phase("ripples")
+                zoomed_ripples.draw(self.zoom_temp)
+                frame_timing.phase("level")
+
+            if zooming:
+                # Only the middle of the zoomed in frame is on screen, so
+                # only that part is scaled, straight onto the screen, which
+                # it covers completely
+                width = int(round(constants.SCREEN_WIDTH / self.zoom))
+                height = int(round(constants.SCREEN_HEIGHT / self.zoom))
+                visible = pygame.Rect(0, 0, width, height)
+                visible.center = constants.SCREEN_MIDDLE_INT
+                pygame.transform.scale(self.zoom_temp.subsurface(visible), constants.SCREEN_SIZE, surface)
+
+            frame_timing.phase("view")
             draw_view(surface, 50)
 
             if debug_mode:
                 debug_collision()
 
-            unzoomed_ripples.draw(surface)
+            frame_timing.phase("ripples")
+            dirty_rects.add(unzoomed_ripples.draw(surface))
+            frame_timing.phase("other")
 
             y = 90
             for index in range(self.level.goal_count):
@@ -745,15 +710,15 @@ class PlayScreen:
                 else:
                     color = BLACK
 
-                pygame.draw.circle(surface, color, (x, y), Signal.RADIUS, width)
+                dirty_rects.add(pygame.draw.circle(surface, color, (x, y), Signal.RADIUS, width))
 
         if self.level_num == 0:
             for text in self.TUTORIAL_TEXT[self.tutorial_stage]:
-                text.draw(surface, int(self.text_alpha))
+                dirty_rects.add(text.draw(surface, int(self.text_alpha)))
             if self.tutorial_stage == 0:
-                self.CONTINUE_TEXT.draw(surface, int(self.continue_text_alpha))
+                dirty_rects.add(self.CONTINUE_TEXT.draw(surface, int(self.continue_text_alpha)))
             elif self.tutorial_stage == 1 or self.tutorial_stage == 2:
-                self.COMFORTABLE_TEXT.draw(surface, int(self.continue_text_alpha))
+                dirty_rects.add(self.COMFORTABLE_TEXT.draw(surface, int(self.continue_text_alpha)))
 
         elif self.level_num > last_level:
             for text in self.CREDITS_TEXT:
@@ -764,6 +729,7 @@ class PlayScreen:
             surface.blit(self.fade_temp, (0, 0))
 
         # Pause screen
+        frame_timing.phase("pause")
         if self.pause_alpha != 0:
             surface.blit(self.pause_overlay, (0, 0))
 
@@ -891,15 +857,21 @@ class PlayScreen:
             self.show_player = False
 
         self.level_num = level_num
+        level_layer.reset()
+        dirty_rects.refresh(final_display)
         if level_num <= last_level:
             self.level = all_levels[level_num]
+            all_levels.prefetch((level_num + 1, level_num - 1))
 
             self.clear_signals()
             self.signals_width = self.SIGNAL_SPACING * self.level.goal_count - self.SIGNAL_GAP
 
             player_entity.go_to(self.level.start_position)
-            # slightly offset, "gaps" seem to appear at exact 90 degree angles
-            player_entity.angle = self.level.start_orientation + 0.000001
+            player_entity.angle = self.level.start_orientation
+            if precomputed_view:
+                panorama.reset(precomputed_view.level_field(level_num, self.level))
+            else:
+                panorama.reset()
 
         self.previous_signals = []
 
@@ -945,16 +917,8 @@ class PlayScreen:
             sound.play(remove_sounds[self.placed_signals])
 
     def check_win(self):
-        for polygon in self.level.goals:
-            for signal in self.signals:
-                if geometry.point_in_polygon(signal.position, polygon):
-                    break
-            else:
-                break
-        else:
-            return True
-
-        return False
+        """Returns True if every goal has a signal in it."""
+        return self.level.goals_filled(signal.goals for signal in self.signals)
 
     def next_tutorial_stage(self):
         self.changing_tutorial_stage = True
@@ -965,37 +929,9 @@ title_screen = TitleScreen()
 play_screen = PlayScreen()
 player_entity = player.Player()
 
-all_levels = (levels.generate_three_boxes_level(),
-              levels.generate_triangle_level(),
-              levels.generate_jesters_hat_level(),
-              levels.generate_plus_level(),
-              levels.generate_single_line_level(),
-              levels.generate_pentagon_level(),
-              levels.generate_two_lines_level(),
-              levels.generate_tunnel_level(),
-              levels.generate_wings_level(),
-              levels.generate_buckets_level(),
-              levels.generate_reticles_level(),
-              levels.generate_shapes_level(),
-              levels.generate_missing_corner_level(),
-              levels.generate_z_level(),
-              levels.generate_increasing_level(),
-              levels.generate_pegs_level(),
-              levels.generate_staircase_level(),
-              levels.generate_hexagon_level(),
-              levels.generate_alignment_level(),
-              levels.generate_triangle_array_level(),
-              levels.generate_spiral_level(),
-              levels.generate_flag_level(),
-              levels.generate_nerfed_keyhole_level(),
-              levels.generate_boxception_level(),
-              levels.generate_nerfed_diamond_level(),
-              levels.generate_grid_level(),
-              levels.generate_nerfed_h_level(),
-              levels.generate_cube_level(),
-              levels.generate_star_level(),
-              levels.generate_heart_level()
-              )
+# Levels are only built when they are played, so this doesn't take longer
+# as more levels are added
+all_levels = level_registry.LevelRegistry()
 last_level = len(all_levels) - 1
 
 
@@ -1076,38 +1012,72 @@ if last_exited_level == 0:
 else:
     play_screen.show_player = False
 
-sound.load_music("music")
-sound.play_music()
+if frame_trace.enabled:
+    this_module = sys.modules[__name__]
+    frame_trace.wrap(this_module, "draw_view", "draw_view")
+    frame_trace.wrap(this_module, "save_save_data", "save_save_data")
+    frame_trace.wrap(PlayScreen, "load_level")
+    frame_trace.wrap(player.Player, "update_movement")
+    frame_trace.wrap(ripples.RippleHandler, "draw")
+    frame_trace.wrap(utility, "black_text_alpha")
+    frame_trace.wrap(geometry.RayCaster, "cast_all")
+    frame_trace.wrap(view.Panorama, "update")
 
-while True:
-    events.update()
-    if events.quit_program:
-        break
-    sound.update()
 
-    if current_screen == TITLE:
-        title_screen.update()
-        title_screen.draw(final_display)
-        if title_screen.finished:
-            current_screen = GAME
+def main():
+    global current_screen
 
-            pygame.event.set_grab(True)
-            pygame.mouse.set_visible(False)
-            play_screen.alpha = 0.0
+    sound.load_music("music")
+    sound.play_music()
 
-        if title_screen.quit_game:
+    while True:
+        frame_timing.phase("events")
+        events.update()
+        if events.quit_program:
             break
+        if frame_trace.enabled and events.keys.pressed_key == pygame.K_F9:
+            frame_trace.dump()
+        frame_timing.phase("sound")
+        sound.update()
+
+        frame_timing.phase("update")
+        # The debug overlay can be anywhere
+        if current_screen == TITLE or debug_mode:
+            dirty_rects.refresh(final_display)
+
+        if current_screen == TITLE:
+            title_screen.update()
+            frame_timing.phase("other")
+            title_screen.draw(final_display)
+            if title_screen.finished:
+                current_screen = GAME
+
+                pygame.event.set_grab(True)
+                pygame.mouse.set_visible(False)
+                play_screen.alpha = 0.0
+
+            if title_screen.quit_game:
+                break
 
-    elif current_screen == GAME:
-        play_screen.update()
-        if play_screen.quit_game:
-            break
-        play_screen.draw(final_display)
+        elif current_screen == GAME:
+            play_screen.update()
+            if play_screen.quit_game:
+                break
+            play_screen.draw(final_display)
 
-    if debug_mode:
-        debug.debug(clock.get_fps())
-        debug.draw(final_display)
+        frame_timing.phase("other")
+        if debug_mode:
+            debug.debug(clock.get_fps())
+            frame_timing.draw()
+            debug.draw(final_display)
+
+        screen_update(60)
+
+    save_save_data()
+
+    if frame_trace.enabled:
+        frame_trace.dump()
 
-    screen_update(60)
 
-save_save_data()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""Times the game's geometry on every level, so that optimizations can be
+shown to help and slowdowns caught before they ship.
+
+Every level is timed from the same randomly chosen player poses each run.
+Results are in nanoseconds per operation, per level, and are saved as JSON
+so that two revisions can be compared.
+
+To run the benchmarks:  python benchmark.py [results.json]
+To compare two runs:    python benchmark.py compare old.json new.json
+"""
+import json
+import math
+import platform
+import random
+import sys
+import time
+
+import numpy
+
+import constants
+import geometry
+import levels
+import player
+import visibility_field
+
+try:
+    import pygame
+    import view
+except ImportError:
+    # Drawing the view is skipped without pygame
+    pygame = None
+
+RESULTS_PATH = "benchmark_results.json"
+SEED = 0
+POSE_COUNT = 50
+ROUNDS = 3
+
+
+def clock():
+    """Returns the time in nanoseconds."""
+    return time.perf_counter() * 1000000000
+
+
+def sample_poses(level, rng, count=POSE_COUNT):
+    """Returns count (position, angle) pairs at random spots where the
+    player could stand, out of the places they can walk to from the start.
+    """
+    cell_size = visibility_field.REACH_CELL_SIZE
+    cells = [(column, row) for row, column in numpy.argwhere(visibility_field.reachable_cells(level)).tolist()]
+    if not cells:
+        # Nowhere to go, so the start is the only place the player stands
+        return [(level.start_position, rng.uniform(-math.pi, math.pi)) for _ in range(count)]
+
+    poses = []
+    while len(poses) < count:
+        points = []
+        for _ in range(count):
+            column, row = rng.choice(cells)
+            points.append([(column + rng.random()) * cell_size, (row + rng.random()) * cell_size])
+
+        points = numpy.array(points)
+        distances = visibility_field.wall_distances(points, level.collision_table)
+        for point, distance in zip(points.tolist(), distances):
+            if distance >= levels.Level.WALL_DISTANCE and len(poses) < count:
+                poses.append((tuple(point), rng.uniform(-math.pi, math.pi)))
+
+    return poses
+
+
+def time_operation(operation, arguments):
+    """Calls operation once for each item in arguments, a few times over,
+    and returns the fastest time per call in nanoseconds.
+    """
+    best = math.inf
+    for _ in range(ROUNDS):
+        start = clock()
+        for argument in arguments:
+            operation(argument)
+        best = min(best, (clock() - start) / len(arguments))
+
+    return best
+
+
+def benchmark_level(level_num, level, rng):
+    """Returns a dictionary of benchmark names to nanoseconds per operation
+    for one level.
+    """
+    poses = sample_poses(level, rng)
+    results = {}
+
+    generate = levels.level_generators[level_num]
+    results["level_construction"] = time_operation(lambda _: generate(), range(5))
+
+    # Each ray comes from a different pose, so none of them are remembered
+    rays = [(position, angle + offset) for position, angle in poses
+            for offset in numpy.linspace(-player.FOV / 2, player.FOV / 2, 10)]
+    results["closest_wall_level"] = time_operation(
+        lambda ray: geometry.closest_wall_level(ray[0], level, ray[1]), rays)
+
+    angles = numpy.linspace(-math.pi, math.pi, 500, endpoint=False)
+    results["closest_walls_level_500_rays"] = time_operation(
+        lambda pose: geometry.closest_walls_level(pose[0], level, angles), poses)
+
+    results["visible_spans"] = time_operation(
+        lambda pose: geometry.visible_spans(pose[0], level), poses)
+
+    walls = level.collision_segments
+    moves = [geometry.Segment(position, geometry.angle_ray(position, angle).point_at(player.Player.MOVEMENT_SPEED))
+             for position, angle in poses]
+    pairs = [(move, wall) for move in moves for wall in walls]
+    results["segments_collide"] = time_operation(
+        lambda pair: geometry.segments_collide(pair[0], pair[1]), pairs)
+
+    goal_checks = [(position, goal) for position, angle in poses for goal in level.goals]
+    results["point_in_polygon"] = time_operation(
+        lambda check: geometry.point_in_polygon(check[0], check[1]), goal_checks)
+    results["goal_mask_lookup"] = time_operation(
+        lambda pose: level.goal_mask.all_indices_at(pose[0]), poses)
+
+    for name, mode in (("movement_step_offset", player.OFFSET_COLLISION),
+                       ("movement_step_circle", player.CIRCLE_COLLISION)):
+        results[name] = time_movement(level, poses, mode)
+
+    results["incremental_visibility_step"] = time_walking_visibility(level, poses)
+
+    if pygame:
+        results["draw_view"] = time_drawing(level, poses)
+
+    return results
+
+
+def time_movement(level, poses, mode):
+    """Times single frames of the player walking forwards from each pose."""
+    old_mode = player.collision_mode
+    player.collision_mode = mode
+    level.build_player_collision()
+
+    walker = player.Player()
+
+    def step(pose):
+        walker.go_to(pose[0])
+        walker.angle = pose[1]
+        walker.walk(level, 0.0, True, False, False, False)
+
+    try:
+        return time_operation(step, poses)
+    finally:
+        player.collision_mode = old_mode
+
+
+def time_walking_visibility(level, poses):
+    """Times updating the sightline as the player walks away from each
+    pose, one frame at a time.
+    """
+    best = math.inf
+    for _ in range(ROUNDS):
+        elapsed = 0.0
+        steps = 0
+        for position, angle in poses:
+            walker = player.Player()
+            walker.go_to(position)
+            walker.angle = angle
+            visibility = geometry.IncrementalVisibility(level)
+            visibility.spans(walker.position)
+            for _ in range(20):
+                walker.walk(level, 0.01, True, False, False, False)
+                start = clock()
+                visibility.spans(walker.position)
+                elapsed += clock() - start
+                steps += 1
+        best = min(best, elapsed / steps)
+
+    return best
+
+
+def time_drawing(level, poses):
+    """Times working out and drawing the view from each pose, the same way
+    the game's draw_view() does.
+    """
+    surface = pygame.Surface(constants.SCREEN_SIZE)
+    panorama = view.Panorama()
+
+    def draw(pose):
+        panorama.update(level, pose[0])
+        panorama.draw(surface, 0, pose[1] - view.FOV / 2)
+
+    return time_operation(draw, poses)
+
+
+def run(path=RESULTS_PATH):
+    """Benchmarks every level and saves the results to path."""
+    results = {"python": platform.python_version(),
+               "seed": SEED,
+               "pose_count": POSE_COUNT,
+               "levels": {}}
+
+    for level_num, generate in enumerate(levels.level_generators):
+        rng = random.Random(SEED * 1000 + level_num)
+        level_results = benchmark_level(level_num, generate(), rng)
+        results["levels"][str(level_num)] = level_results
+        print("Level %i: %s" % (level_num, ", ".join(
+            "%s %.0f" % (name, ns) for name, ns in sorted(level_results.items()))))
+
+    names = sorted(results["levels"]["0"])
+    results["mean"] = {name: sum(level[name] for level in results["levels"].values()) /
+                       len(results["levels"]) for name in names}
+
+    with open(path, "w") as file:
+        json.dump(results, file, indent=1, sort_keys=True)
+
+    print()
+    for name in names:
+        print("%-30s %12.0f ns/op" % (name, results["mean"][name]))
+
+
+def compare(old_path, new_path):
+    """Prints how much faster or slower each benchmark got, on average over
+    every level.
+    """
+    with open(old_path) as file:
+        old = json.load(file)
+    with open(new_path) as file:
+        new = json.load(file)
+
+    for name in sorted(set(old["mean"]) & set(new["mean"])):
+        ratio = old["mean"][name] / new["mean"][name]
+        print("%-30s %12.0f -> %12.0f ns/op  (%.2fx)" % (name, old["mean"][name], new["mean"][name], ratio))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 4 and sys.argv[1] == "compare":
+        compare(sys.argv[2], sys.argv[3])
+    elif len(sys.argv) > 1:
+        run(sys.argv[1])
+    else:
+        run()
@@ -0,0 +1,81 @@
+"""Sends only the parts of the screen that changed to the display.
+
+Most of a frame is the level, which doesn't move.  Everything drawn on top
+of it reports the rectangle it drew on with add(), and present() updates
+just those rectangles, along with last frame's so that whatever moved away
+is cleaned up.  Afterwards only those rectangles are filled with white
+again, so the level has to be drawn every frame (see view.LevelLayer).
+
+Anything that covers the whole screen, like fades, zooming and the pause
+menu, calls refresh() before drawing instead, which clears and presents the
+whole screen.  So does anything that changes what is under everything else,
+like loading a level.
+
+Turning enabled off presents the whole screen every frame.
+"""
+import pygame
+
+import constants
+
+enabled = True
+
+# Drawn on this frame, and on the frame before
+rects = []
+previous_rects = []
+
+# How many more frames present the whole screen
+full_frames = 2
+
+# Whether the whole surface is white, so refresh() has nothing to clear
+surface_clear = True
+
+
+def add(*new_rects):
+    """Marks each rectangle as drawn on this frame.  Any that are None are
+    skipped, so the return values of draw functions can be passed in.
+    """
+    for rect in new_rects:
+        if rect:
+            rects.append(rect)
+
+
+def refresh(surface):
+    """Makes this frame present the whole screen.  So does the next one,
+    since whatever covered the screen this frame might not be there then.
+
+    Anything left over from the last frame is cleared off surface, so this
+    has to be called before anything is drawn on it this frame.
+    """
+    global full_frames, surface_clear
+
+    full_frames = 2
+    if not surface_clear:
+        surface.fill(constants.WHITE)
+        surface_clear = True
+
+
+def present():
+    """Sends this frame to the display."""
+    if not enabled or full_frames:
+        pygame.display.flip()
+    else:
+        pygame.display.update(previous_rects + rects)
+
+
+def clear(surface):
+    """Fills everything drawn this frame with white, ready for the next
+    frame.
+    """
+    global rects, previous_rects, full_frames, surface_clear
+
+    if not enabled or full_frames:
+        surface.fill(constants.WHITE)
+        full_frames = max(full_frames - 1, 0)
+        surface_clear = True
+    else:
+        for rect in rects:
+            surface.fill(constants.WHITE, rect)
+        surface_clear = False
+
+    previous_rects = rects
+    rects = []
@@ -1,8 +1,6 @@
 import pygame
 import sys
 
-pygame.init()
-
 
 class MouseHandler:
     def __init__(self):
@@ -0,0 +1,118 @@
+"""Times each part of every frame, to show where the frame's time goes.
+
+Call phase() whenever the game moves on to a different part of the frame,
+and end_frame() once the frame is done (before waiting for the next one).
+The time of each phase over the last HISTORY frames is kept, and draw()
+shows it as a graph of recent frames along with the median (p50) and
+99th percentile (p99) of each phase, using the debug module.
+
+Does nothing unless enabled is True, other than passing the phases on to
+frame_trace when it is recording.
+"""
+import time
+
+import constants
+import debug
+import frame_trace
+
+enabled = False
+
+HISTORY = 120
+PHASES = ("events", "sound", "update", "level", "view", "ripples", "pause", "flip", "other")
+COLORS = {"events": constants.RED,
+          "sound": constants.ORANGE,
+          "update": constants.YELLOW,
+          "level": constants.GREEN,
+          "view": constants.CYAN,
+          "ripples": constants.BLUE,
+          "pause": constants.MAGENTA,
+          "flip": constants.DARK_GREY,
+          "other": constants.LIGHT_GREY}
+
+# One ring buffer of times (in seconds) per phase, all sharing frame_index
+times = {name: [0.0] * HISTORY for name in PHASES}
+frame_index = 0
+frames_recorded = 0
+
+current_phase = None
+phase_start = 0.0
+
+# Where the graph is drawn, and how tall a millisecond is
+GRAPH_LEFT = 10
+GRAPH_BOTTOM = constants.SCREEN_HEIGHT - 10
+GRAPH_SCALE = 4
+FRAME_BUDGET = 1000 / 60
+
+
+def phase(name):
+    """Ends the phase that is running, if any, and starts timing name."""
+    global current_phase, phase_start
+
+    if not enabled and not frame_trace.enabled:
+        return
+
+    now = time.perf_counter()
+    if current_phase:
+        times[current_phase][frame_index] += now - phase_start
+        frame_trace.end(current_phase, now)
+    if name:
+        frame_trace.begin(name, now)
+    current_phase = name
+    phase_start = now
+
+
+def end_frame():
+    """Ends the running phase, and moves on to the next frame."""
+    global frame_index, frames_recorded
+
+    phase(None)
+    if not enabled:
+        return
+
+    frame_index = (frame_index + 1) % HISTORY
+    # The slot for the frame in progress isn't a finished frame
+    frames_recorded = min(frames_recorded + 1, HISTORY - 1)
+    for name in PHASES:
+        times[name][frame_index] = 0.0
+
+
+def recorded_frames(name):
+    """Returns the recorded times of a phase, oldest first, in milliseconds."""
+    ring = times[name]
+    ordered = ring[frame_index + 1:] + ring[:frame_index]
+    return [seconds * 1000 for seconds in ordered[len(ordered) - frames_recorded:]]
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+
+    ordered = sorted(values)
+    return ordered[min(int(fraction * len(ordered)), len(ordered) - 1)]
+
+
+def draw():
+    """Adds the graph and the p50/p99 of each phase to the debug overlay."""
+    if not enabled:
+        return
+
+    frames = {name: recorded_frames(name) for name in PHASES}
+
+    totals = [sum(frames[name][frame] for name in PHASES) for frame in range(frames_recorded)]
+    debug.debug("frame p50 %.2f ms  p99 %.2f ms" % (percentile(totals, 0.5), percentile(totals, 0.99)))
+    for name in PHASES:
+        debug.debug("%s p50 %.2f ms  p99 %.2f ms" % (name, percentile(frames[name], 0.5),
+                                                    percentile(frames[name], 0.99)))
+
+    # Each frame is a column, with its phases stacked from the bottom up
+    for frame in range(frames_recorded):
+        x = GRAPH_LEFT + frame
+        y = GRAPH_BOTTOM
+        for name in PHASES:
+            height = frames[name][frame] * GRAPH_SCALE
+            if height >= 1:
+                debug.new_line((x, y), (x, y - height), COLORS[name])
+                y -= height
+
+    budget_y = GRAPH_BOTTOM - FRAME_BUDGET * GRAPH_SCALE
+    debug.new_line((GRAPH_LEFT, budget_y), (GRAPH_LEFT + HISTORY, budget_y), constants.BLACK)
@@ -0,0 +1,109 @@
+"""Records what the game spends its time on, to look at afterwards.
+
+Run the game as  python Sightline.py --trace  to turn recording on.  The
+begin and end of each frame phase (see frame_timing) and of each function
+given to wrap() are kept in a buffer that is made once at the start, and
+once the buffer is full the oldest events are written over.  dump() saves
+the events as a JSON trace that chrome://tracing and Perfetto can open;
+the game does this when it exits, and whenever F9 is pressed.
+
+Functions are only wrapped once recording is on, so nothing here costs
+anything when it is off.
+"""
+import functools
+import json
+import threading
+import time
+
+enabled = False
+
+BUFFER_SIZE = 1 << 19
+TRACE_PATH = "trace.json"
+
+BEGIN = "B"
+END = "E"
+
+# One slot per event in each list, all sharing event_index
+names = [None] * BUFFER_SIZE
+kinds = [None] * BUFFER_SIZE
+timestamps = [0.0] * BUFFER_SIZE
+threads = [0] * BUFFER_SIZE
+event_index = 0
+events_recorded = 0
+
+
+def record(name, kind, timestamp=None):
+    global event_index, events_recorded
+
+    if timestamp is None:
+        timestamp = time.perf_counter()
+
+    names[event_index] = name
+    kinds[event_index] = kind
+    timestamps[event_index] = timestamp
+    threads[event_index] = threading.get_ident()
+
+    event_index = (event_index + 1) % BUFFER_SIZE
+    events_recorded = min(events_recorded + 1, BUFFER_SIZE)
+
+
+def begin(name, timestamp=None):
+    """Records the start of name, if recording is on."""
+    if enabled:
+        record(name, BEGIN, timestamp)
+
+
+def end(name, timestamp=None):
+    """Records the end of name, if recording is on."""
+    if enabled:
+        record(name, END, timestamp)
+
+
+def wrap(owner, attribute, name=None):
+    """Replaces the function owner.attribute with one that records when
+    each call to it begins and ends.  owner can be a module or a class.
+    """
+    function = getattr(owner, attribute)
+    if name is None:
+        name = "%s.%s" % (owner.__name__, attribute)
+
+    @functools.wraps(function)
+    def traced(*args, **kwargs):
+        record(name, BEGIN)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            record(name, END)
+
+    setattr(owner, attribute, traced)
+
+
+def recorded_events():
+    """Returns the recorded (name, kind, timestamp, thread) events, oldest
+    first.
+    """
+    start = (event_index - events_recorded) % BUFFER_SIZE
+    order = [(start + offset) % BUFFER_SIZE for offset in range(events_recorded)]
+    return [(names[index], kinds[index], timestamps[index], threads[index]) for index in order]
+
+
+def dump(path=TRACE_PATH):
+    """Saves every recorded event to path in the Chrome trace format."""
+    events = recorded_events()
+    if not events:
+        return
+
+    # Thread IDs are huge, so they are numbered in the order they show up
+    thread_numbers = {}
+    first_timestamp = events[0][2]
+    trace_events = []
+    for name, kind, timestamp, thread in events:
+        thread_number = thread_numbers.setdefault(thread, len(thread_numbers))
+        trace_events.append({"name": name,
+                             "ph": kind,
+                             "ts": round((timestamp - first_timestamp) * 1000000, 3),
+                             "pid": 0,
+                             "tid": thread_number})
+
+    with open(path, "w") as file:
+        json.dump({"traceEvents": trace_events, "displayTimeUnit": "ms"}, file)
@@ -1,12 +1,15 @@
-import pygame
+import numpy
+import bisect
 import math
-import os
 
 import constants
 import utility
 
-os.environ['SDL_VIDEO_CENTERED'] = '1'
-pygame.init()
+try:
+    import pygame
+except ImportError:
+    # Only needed for the debug drawing, so the game's logic can run without it
+    pygame = None
 
 
 def mod_angle(angle):
@@ -43,26 +46,117 @@ def angles_close(angle1, angle2, threshold=0.001):
     return False
 
 
-def closest_wall(position, polygon, angle):
-    """Returns the closest segment in polygon that collides with a ray.
+class Ray:
+    """A ray that starts at origin and heads in the direction of
+    (delta_x, delta_y).
 
-    The ray starts at position and has an angle of angle (in radians).
+    Points along the ray are origin + t * (delta_x, delta_y), so when the
+    direction has a length of 1, t is the distance from the origin.
     """
-    line = Line(position, angle_to_slope(angle))
-    shortest_distance = 10000000.0
+    def __init__(self, origin, delta_x, delta_y):
+        self.origin = origin
+        self.delta_x = delta_x
+        self.delta_y = delta_y
+
+    def point_at(self, t):
+        return self.origin[0] + self.delta_x * t, self.origin[1] + self.delta_y * t
+
+
+def angle_ray(position, angle):
+    """Returns a Ray starting at position with an angle of angle (in radians).
+    The direction has a length of 1.
+    """
+    return Ray(position, math.cos(angle), math.sin(angle))
+
+
+# How far past the end of a segment a ray can hit and still count, in pixels.
+# Matches the tolerance of on_segment().
+RAY_EPSILON = 0.00005
+
+
+def ray_segment_intersection(ray, segment):
+    """Returns the (t, u) pair where a Ray hits a Segment, or None if it
+    doesn't.
+
+    The point of intersection is ray.point_at(t), which is also u of the way
+    from segment.point1 to segment.point2.  Hits behind the ray (t <= 0) and
+    parallel segments count as misses.
+    """
+    denominator = ray.delta_x * segment.delta_y - ray.delta_y * segment.delta_x
+    if denominator == 0.0:
+        return None
+
+    # origin + t * ray = point1 + u * segment, solved with cross products
+    to_start_x = segment.point1[0] - ray.origin[0]
+    to_start_y = segment.point1[1] - ray.origin[1]
+
+    t = (to_start_x * segment.delta_y - to_start_y * segment.delta_x) / denominator
+    if t <= 0.0:
+        return None
+
+    u = (to_start_x * ray.delta_y - to_start_y * ray.delta_x) / denominator
+    tolerance = RAY_EPSILON / segment.length
+    if u < -tolerance or u > 1.0 + tolerance:
+        return None
+
+    return t, u
+
+
+def closest_ray_hit(ray, segments):
+    """Returns a (segment, t) pair for the closest segment that the ray
+    hits, or None if it hits nothing.  Ties go to the earliest segment.
+    """
+    closest_t = math.inf
     closest = None
 
-    for segment in polygon.segments:
-        intersection = line_segment_intersection(line, segment)
+    for segment in segments:
+        intersection = ray_segment_intersection(ray, segment)
+        if intersection and intersection[0] < closest_t:
+            closest_t = intersection[0]
+            closest = segment
+
+    if closest:
+        return closest, closest_t
+    return None
+
+
+def farthest_ray_hit(ray, segments):
+    """Same as closest_ray_hit(), but for the farthest segment."""
+    farthest_t = 0.0
+    farthest = None
+
+    for segment in segments:
+        intersection = ray_segment_intersection(ray, segment)
+        if intersection and intersection[0] > farthest_t:
+            farthest_t = intersection[0]
+            farthest = segment
+
+    if farthest:
+        return farthest, farthest_t
+    return None
+
+
+def any_ray_hit(ray, segments):
+    """Returns a (segment, t) pair for the first segment found that the ray
+    hits, or None if it hits nothing.
+    """
+    for segment in segments:
+        intersection = ray_segment_intersection(ray, segment)
         if intersection:
-            distance_between = distance(position, intersection)
-            angle_check = angle_between(position, intersection)
-            if distance_between < shortest_distance:
-                if angles_close(angle, angle_check):
-                    shortest_distance = distance_between
-                    closest = segment
+            return segment, intersection[0]
+
+    return None
 
-    return closest
+
+def closest_wall(position, polygon, angle):
+    """Returns the closest segment in polygon that collides with a ray.
+
+    The ray starts at position and has an angle of angle (in radians).
+    """
+    hit = closest_ray_hit(angle_ray(position, angle), polygon.segments)
+    if hit:
+        return hit[0]
+    return None
 
 
 def closest_wall_intersection(position, polygon, angle):
@@ -71,76 +165,475 @@ def closest_wall_intersection(position, polygon, angle):
 
     The ray starts at position and has an angle of angle (in radians).
     """
-    line = Line(position, angle_to_slope(angle))
-    shortest_distance = 10000000.0
-    closest_intersection = None
-
-    for segment in polygon.segments:
-        intersection = line_segment_intersection(line, segment)
-        if intersection:
-            distance_between = distance(position, intersection)
-            angle_check = angle_between(position, intersection)
-            if distance_between < shortest_distance:
-                if angles_close(angle, angle_check):
-                    shortest_distance = distance_between
-                    closest_intersection = intersection
-
-    return closest_intersection
+    ray = angle_ray(position, angle)
+    hit = closest_ray_hit(ray, polygon.segments)
+    if hit:
+        return ray.point_at(hit[1])
+    return None
 
 
 def closest_wall_level(position, level, angle):
     """Same as closest_wall, except using a level instead of a polygon."""
-    line = Line(position, angle_to_slope(angle))
-    shortest_distance = 10000000.0
-    closest = None
-
-    for polygon in level.collision:
-        for segment in polygon.segments:
-            intersection = line_segment_intersection(line, segment)
-            if intersection:
-                distance_between = distance(position, intersection)
-                angle_check = angle_between(position, intersection)
-                if distance_between < shortest_distance:
-                    if angles_close(angle, angle_check):
-                        shortest_distance = distance_between
-                        closest = segment
-
-    return closest
+    hit = level.rays.cast(position, angle)
+    if hit:
+        return hit.segment
+    return None
 
 
 def closest_wall_level_intersection(position, level, angle):
     """Same as closest_wall_intersection, except using a level instead
     of a polygon.
     """
-    line = Line(position, angle_to_slope(angle))
-    shortest_distance = 10000000.0
-    closest_intersection = None
+    hit = level.rays.cast(position, angle)
+    if hit:
+        return hit.point
+    return None
+
+
+def cast_rays(position, angles, table):
+    """Casts a batch of rays from position against every segment at once.
+
+    angles is a sequence of ray angles (in radians).  table is the
+    SegmentTable of the segments to cast against.
+
+    Returns an (indices, points, distances) tuple, with one entry per ray.
+    indices holds the index of the closest segment hit, or -1 if the ray
+    does not hit anything.  points and distances are nan for those rays.
+    Ties are broken in favour of the earliest segment, the same as
+    closest_wall_level().
+    """
+    angles = numpy.asarray(angles, dtype=float).reshape(-1)
+    ray_x = numpy.cos(angles)[:, numpy.newaxis]
+    ray_y = numpy.sin(angles)[:, numpy.newaxis]
+
+    to_start_x = table.x1 - position[0]
+    to_start_y = table.y1 - position[1]
+    segment_x = table.delta_x
+    segment_y = table.delta_y
+
+    # position + t * ray = start + u * direction, solved with cross products.
+    # Since the ray has a length of 1, t is also the distance to the hit.
+    denominator = ray_x * segment_y - ray_y * segment_x
+    t_numerator = to_start_x * segment_y - to_start_y * segment_x
+    u_numerator = to_start_x * ray_y - to_start_y * ray_x
+    with numpy.errstate(divide="ignore", invalid="ignore"):
+        t = t_numerator / denominator
+        u = u_numerator / denominator
+
+    # Parallel segments give nan or inf, which fail every comparison here
+    tolerance = RAY_EPSILON / table.length
+    hit = (t > 0.0) & (u >= -tolerance) & (u <= 1.0 + tolerance)
+    t = numpy.where(hit, t, numpy.inf)
+
+    ray_count = len(angles)
+    if t.shape[1] == 0:
+        indices = numpy.full(ray_count, -1)
+        distances = numpy.full(ray_count, numpy.nan)
+    else:
+        indices = numpy.argmin(t, axis=1)
+        distances = t[numpy.arange(ray_count), indices]
+        missed = numpy.isinf(distances)
+        indices[missed] = -1
+        distances[missed] = numpy.nan
+
+    points = numpy.empty((ray_count, 2))
+    points[:, 0] = position[0] + ray_x[:, 0] * distances
+    points[:, 1] = position[1] + ray_y[:, 0] * distances
+
+    return indices, points, distances
 
-    for polygon in level.collision:
-        for segment in polygon.segments:
-            intersection = line_segment_intersection(line, segment)
-            if intersection:
-                distance_between = distance(position, intersection)
-                angle_check = angle_between(position, intersection)
-                if distance_between < shortest_distance:
-                    if angles_close(angle, angle_check):
-                        shortest_distance = distance_between
-                        closest_intersection = intersection
 
-    return closest_intersection
+def closest_walls_level(position, level, angles):
+    """Batched version of closest_wall_level() and
+    closest_wall_level_intersection().  See cast_rays() for the return value.
+    Segment indices refer to level.collision_table.
+    """
+    return cast_rays(position, angles, level.collision_table)
 
 
 def level_wall_in_direction(position, level, angle):
-    line = Line(position, angle_to_slope(angle))
-    for polygon in level.collision:
-        for segment in polygon.segments:
-            intersection = line_segment_intersection(line, segment)
-            if intersection:
-                angle_check = angle_between(position, intersection)
-                if angles_close(angle, angle_check):
-                    return True
+    return level.rays.cast(position, angle, RayCaster.ANY) is not None
+
+
+# Points closer than this to a line (in pixels) count as being on it
+SIDE_EPSILON = 0.000001
+
+
+def side_of_segment(segment, point):
+    """Returns 1 or -1 depending on which side of segment's (infinite) line
+    the point is on, or 0 if it is on the line.
+    """
+    cross = (segment.delta_x * (point[1] - segment.point1[1]) -
+             segment.delta_y * (point[0] - segment.point1[0]))
+    if abs(cross) <= SIDE_EPSILON * segment.length:
+        return 0
+    if cross > 0.0:
+        return 1
+    return -1
+
+
+def segment_in_front(segment_1, segment_2, position):
+    """Returns True if segment_1 is closer to position than segment_2.
+
+    Only meaningful for segments that do not cross each other, and that
+    overlap when seen from position (some ray from position hits both).
+    """
+    # If segment_2 is entirely on the far side of segment_1, then segment_1
+    # is in front, and if it is entirely on the near side, it is behind
+    viewer_side = side_of_segment(segment_1, position)
+    side_1 = side_of_segment(segment_1, segment_2.point1)
+    side_2 = side_of_segment(segment_1, segment_2.point2)
+    if side_1 or side_2:
+        if side_1 != viewer_side and side_2 != viewer_side:
+            return True
+        if side_1 != -viewer_side and side_2 != -viewer_side:
+            return False
+
+        # segment_2 crosses segment_1's line, so segment_1 must be entirely
+        # on one side of segment_2's line instead
+        viewer_side = side_of_segment(segment_2, position)
+        side_1 = side_of_segment(segment_2, segment_1.point1)
+        side_2 = side_of_segment(segment_2, segment_1.point2)
+        return side_1 != -viewer_side and side_2 != -viewer_side
+
+    # Both segments are on the same line
+    middle_1 = utility.average_points(segment_1.point1, segment_1.point2)
+    middle_2 = utility.average_points(segment_2.point1, segment_2.point2)
+    return distance(position, middle_1) < distance(position, middle_2)
+
+
+class SweepHeap:
+    """A binary heap of the segments that the sweeping ray of
+    visible_spans() currently crosses, with the closest one on top.
+
+    Segments are stored as indices into segments.  Unlike heapq, any segment
+    can be removed in O(log n), not just the top one.
+    """
+    def __init__(self, segments, position):
+        self.segments = segments
+        self.position = position
+        self.heap = []
+        self.heap_indices = {}
+
+    def top(self):
+        if self.heap:
+            return self.heap[0]
+        return None
+
+    def push(self, index):
+        self.heap.append(index)
+        self.heap_indices[index] = len(self.heap) - 1
+        self.sift_up(len(self.heap) - 1)
+
+    def remove(self, index):
+        heap_index = self.heap_indices.pop(index)
+        last = self.heap.pop()
+        if heap_index < len(self.heap):
+            self.heap[heap_index] = last
+            self.heap_indices[last] = heap_index
+            self.sift_up(heap_index)
+            self.sift_down(self.heap_indices[last])
+
+    def in_front(self, index_1, index_2):
+        return segment_in_front(self.segments[index_1], self.segments[index_2], self.position)
+
+    def swap(self, heap_index_1, heap_index_2):
+        heap = self.heap
+        heap[heap_index_1], heap[heap_index_2] = heap[heap_index_2], heap[heap_index_1]
+        self.heap_indices[heap[heap_index_1]] = heap_index_1
+        self.heap_indices[heap[heap_index_2]] = heap_index_2
+
+    def sift_up(self, heap_index):
+        while heap_index > 0:
+            parent = (heap_index - 1) // 2
+            if not self.in_front(self.heap[heap_index], self.heap[parent]):
+                break
+            self.swap(heap_index, parent)
+            heap_index = parent
+
+    def sift_down(self, heap_index):
+        length = len(self.heap)
+        while True:
+            closest = heap_index
+            for child in (heap_index * 2 + 1, heap_index * 2 + 2):
+                if child < length and self.in_front(self.heap[child], self.heap[closest]):
+                    closest = child
+
+            if closest == heap_index:
+                break
+            self.swap(heap_index, closest)
+            heap_index = closest
+
+
+def visible_spans(position, level):
+    """Returns the colors seen from position, all the way around.
+
+    The result is a list of (start_angle, end_angle, color) spans sorted by
+    angle, which covers every angle from -pi to pi.  Directions where no
+    wall is seen are WHITE.
+
+    Rather than casting a ray at every vertex, a single ray is swept around
+    the circle.  The segments it crosses are kept in a SweepHeap, so the
+    closest one only has to be looked up when the ray passes an endpoint.
+    That makes the whole thing O(n log n) in the number of segments.
+    """
+    segments = level.collision_segments
+    angles = endpoint_angles(position, segments)
+    events, orientations = sweep_events(angles, len(segments))
+    events.sort()
+    boundaries, first_closest = sweep(position, segments, events)
+    return boundary_spans(segments, boundaries, first_closest)
 
-    return False
+
+def endpoint_angles(position, segments):
+    """Returns a dictionary of the angle from position to every endpoint,
+    keyed by (segment index, point number).  Point number is 1 or 2.
+    """
+    angles = {}
+    for index, segment in enumerate(segments):
+        angles[index, 1] = angle_between(position, segment.point1)
+        angles[index, 2] = angle_between(position, segment.point2)
+    return angles
+
+
+def segment_orientations(angles, count):
+    """Returns, for each of count segments, 1 if a counterclockwise ray
+    reaches point1 first, -1 if it reaches point2 first, or 0 if the
+    segment is seen edge-on (and so is invisible).
+
+    angles is the dictionary from endpoint_angles().
+    """
+    orientations = []
+    for index in range(count):
+        extent = mod_angle(angles[index, 2] - angles[index, 1])
+        if extent > 0.0:
+            orientations.append(1)
+        elif extent < 0.0:
+            orientations.append(-1)
+        else:
+            orientations.append(0)
+    return orientations
+
+
+def sweep_events(angles, count, order=None):
+    """Returns an (events, orientations) pair for sweep(), given the
+    endpoint_angles() of count segments.
+
+    Events are (angle, kind, segment index, point number) tuples, where kind
+    is 0 when the ray leaves a segment and 1 when it reaches one.  Leaving
+    first means corners are never seen as a gap.  The events still need to
+    be sorted.  orientations is from segment_orientations().
+
+    order is an optional list of (segment index, point number) pairs.  If
+    given, the events come out in that order, which makes sorting them
+    almost free when the order is from a nearby position.
+    """
+    orientations = segment_orientations(angles, count)
+
+    if order is None:
+        order = sorted(angles.keys())
+
+    events = []
+    for index, point_number in order:
+        orientation = orientations[index]
+        if not orientation:
+            continue
+
+        if (point_number == 1) == (orientation == 1):
+            kind = 1
+        else:
+            kind = 0
+        events.append((angles[index, point_number], kind, index, point_number))
+
+    return events, orientations
+
+
+def sweep(position, segments, events):
+    """Sweeps a ray from -pi to pi, through sorted sweep_events().
+
+    Returns a (boundaries, first_closest) pair.  Boundaries are
+    (angle, event number, closest) tuples, one for every event where the
+    closest segment changes, with closest being the index of the new closest
+    segment (or None).  first_closest is the closest segment at -pi.
+    """
+    heap = SweepHeap(segments, position)
+
+    # The ray starts out pointing at -pi, so it already crosses the
+    # segments that wrap around from pi to -pi
+    start_angles = {}
+    for angle, kind, index, point_number in events:
+        if kind:
+            start_angles[index] = angle
+    for angle, kind, index, point_number in events:
+        if not kind and start_angles[index] > angle:
+            heap.push(index)
+
+    boundaries = []
+    first_closest = heap.top()
+    current = first_closest
+    event_number = 0
+    while event_number < len(events):
+        group_start = event_number
+        angle = events[event_number][0]
+        while event_number < len(events) and events[event_number][0] == angle:
+            kind = events[event_number][1]
+            index = events[event_number][2]
+            if kind:
+                heap.push(index)
+            else:
+                heap.remove(index)
+            event_number += 1
+
+        closest = heap.top()
+        if closest != current:
+            boundaries.append((angle, group_start, closest))
+            current = closest
+
+    return boundaries, first_closest
+
+
+def boundary_spans(segments, boundaries, first_closest):
+    """Turns the boundaries from sweep() into a list of spans, like the
+    one visible_spans() returns.
+    """
+    spans = []
+    span_start = -math.pi
+    current = first_closest
+    for angle, event_number, closest in boundaries:
+        add_span(spans, span_start, angle, span_color(segments, current))
+        span_start = angle
+        current = closest
+
+    add_span(spans, span_start, math.pi, span_color(segments, current))
+    return spans
+
+
+class IncrementalVisibility:
+    """Works out visible_spans() for a player that only moves a little
+    between frames, reusing as much of the last frame as it can.
+
+    Which segment is closest between two endpoints can only change when the
+    endpoints change their order around the player (or a segment flips
+    around to face the other way).  So each frame the endpoint angles are
+    recomputed in last frame's order, and if that order still goes around
+    the circle exactly once, last frame's boundaries are reused with their
+    new angles and nothing is swept at all.
+
+    Otherwise, the events are sorted starting from last frame's order,
+    which is nearly sorted already, and swept again.  Big jumps, like
+    loading a level, start over from scratch.
+    """
+    MAX_STEP = 5.0
+
+    def __init__(self, level):
+        self.segments = level.collision_segments
+        self.reset()
+
+    def reset(self):
+        self.position = None
+        self.order = None
+        self.orientations = None
+        self.boundaries = []
+        self.first_closest = None
+        self.reusable = False
+
+    def spans(self, position):
+        segments = self.segments
+        moved = self.position is None or distance(self.position, position) > self.MAX_STEP
+        self.position = position
+
+        angles = endpoint_angles(position, segments)
+        if moved:
+            self.order = None
+        elif self.reusable:
+            order_angles = tuple(angles[key] for key in self.order)
+            orientations = segment_orientations(angles, len(segments))
+            if self.same_order(order_angles) and orientations == self.orientations:
+                self.move_boundaries(order_angles)
+                return boundary_spans(segments, self.boundaries, self.first_closest)
+
+        events, self.orientations = sweep_events(angles, len(segments), self.order)
+        events.sort()
+        self.boundaries, self.first_closest = sweep(position, segments, events)
+
+        # Edge-on segments have no events, but still need a place in the
+        # order in case they turn to face the player
+        self.order = [(event[2], event[3]) for event in events]
+        for index, orientation in enumerate(self.orientations):
+            if not orientation:
+                self.order.append((index, 1))
+                self.order.append((index, 2))
+
+        # Different points at the exact same angle could come apart in any
+        # order, so the boundaries can't be trusted next frame
+        self.reusable = all(self.orientations)
+        for event_number in range(1, len(events)):
+            event = events[event_number]
+            previous = events[event_number - 1]
+            if event[0] == previous[0]:
+                point = endpoint(segments[event[2]], event[3])
+                previous_point = endpoint(segments[previous[2]], previous[3])
+                if point != previous_point:
+                    self.reusable = False
+                    break
+
+        return boundary_spans(segments, self.boundaries, self.first_closest)
+
+    def same_order(self, angles):
+        """Returns True if angles, in last frame's order, still go around
+        the circle exactly once.
+        """
+        if len(angles) < 2:
+            return True
+
+        total = 0.0
+        for index in range(len(angles)):
+            total += (angles[index] - angles[index - 1]) % (math.pi * 2)
+
+        # Any point that overtook another adds a whole extra turn
+        return total < math.pi * 3
+
+    def move_boundaries(self, angles):
+        """Gives every boundary its new angle, and rotates the list so it
+        starts at -pi again.
+        """
+        boundaries = [(angles[event_number], event_number, closest)
+                      for angle, event_number, closest in self.boundaries]
+        if not boundaries:
+            return
+
+        first = 0
+        for index in range(1, len(boundaries)):
+            if boundaries[index][0] < boundaries[first][0]:
+                first = index
+
+        self.boundaries = boundaries[first:] + boundaries[:first]
+        self.first_closest = self.boundaries[-1][2]
+
+
+def endpoint(segment, point_number):
+    if point_number == 1:
+        return segment.point1
+    return segment.point2
+
+
+def span_color(segments, index):
+    if index is None:
+        return constants.WHITE
+    return segments[index].color
+
+
+def add_span(spans, start_angle, end_angle, color):
+    """Adds a span to the end of spans, merging it with the last one if
+    they are the same color.  Empty spans are skipped.
+    """
+    if end_angle <= start_angle:
+        return
+
+    if spans and spans[-1][2] == color:
+        spans[-1] = (spans[-1][0], end_angle, color)
+    else:
+        spans.append((start_angle, end_angle, color))
 
 
 def component_in_direction(vector, direction):
@@ -261,6 +754,8 @@ class Segment:
         self.point2 = point2
 
         self.length = distance(point1, point2)
+        self.delta_x = point2[0] - point1[0]
+        self.delta_y = point2[1] - point1[1]
         self.slope = two_point_slope(point1, point2)
 
         # y_intercept is stored as if the segment was infinite
@@ -353,6 +848,375 @@ def points_to_segment_list(point_list, closed=True):
     return segment_list
 
 
+class SegmentTable:
+    """A struct-of-arrays copy of a list of segments.
+
+    Every field is a contiguous array with one entry per segment, and all
+    of them are views into a single buffer.  That buffer can be anything
+    that supports the buffer protocol (a bytearray, an mmap, shared memory),
+    so a table can be handed to another process or saved to disk and read
+    back without copying it.
+
+    colors holds an index into palette for every segment.
+    """
+    FIELDS = ("x1", "y1", "x2", "y2", "delta_x", "delta_y", "length",
+              "min_x", "min_y", "max_x", "max_y")
+
+    def __init__(self, buffer, count, palette):
+        self.buffer = buffer
+        self.count = count
+        self.palette = tuple(palette)
+
+        field_size = count * 8
+        for index, field in enumerate(self.FIELDS):
+            array = numpy.frombuffer(buffer, numpy.float64, count, index * field_size)
+            setattr(self, field, array)
+
+        colors_offset = len(self.FIELDS) * field_size
+        self.colors = numpy.frombuffer(buffer, numpy.uint8, count, colors_offset)
+
+    def __len__(self):
+        return self.count
+
+
+def segment_table_size(count):
+    """Returns the size of the buffer, in bytes, that a SegmentTable with
+    count segments needs."""
+    return count * (len(SegmentTable.FIELDS) * 8 + 1)
+
+
+def segment_table(segments):
+    """Compiles a sequence of Segments into a new SegmentTable.
+
+    The table keeps the same order as the sequence.
+    """
+    segments = tuple(segments)
+    count = len(segments)
+
+    palette = []
+    for segment in segments:
+        if segment.color not in palette:
+            palette.append(segment.color)
+
+    # The palette is indexed with a single byte
+    if len(palette) > 256:
+        raise ValueError("A segment table can hold at most 256 colors")
+
+    table = SegmentTable(bytearray(segment_table_size(count)), count, palette)
+    for index, segment in enumerate(segments):
+        table.x1[index], table.y1[index] = segment.point1
+        table.x2[index], table.y2[index] = segment.point2
+        table.colors[index] = palette.index(segment.color)
+
+    table.delta_x[:] = table.x2 - table.x1
+    table.delta_y[:] = table.y2 - table.y1
+    table.length[:] = numpy.hypot(table.delta_x, table.delta_y)
+    numpy.minimum(table.x1, table.x2, out=table.min_x)
+    numpy.minimum(table.y1, table.y2, out=table.min_y)
+    numpy.maximum(table.x1, table.x2, out=table.max_x)
+    numpy.maximum(table.y1, table.y2, out=table.max_y)
+
+    return table
+
+
+class SegmentGrid:
+    """A uniform grid laid over a list of segments, where every cell knows
+    which segments pass through it.
+
+    Ray queries walk only the cells along the ray, in order, and stop as soon
+    as a hit is found that can't be beaten by anything further along.  The
+    results are the same as the linear scan in closest_ray_hit().
+    """
+    MIN_CELL_SIZE = 8.0
+    MARGIN = 1.0
+
+    def __init__(self, segments, table):
+        self.segments = tuple(segments)
+
+        # The grid is a bit bigger than the segments, so that segments on
+        # its edge are still inside it
+        if len(table):
+            self.left = float(table.min_x.min()) - self.MARGIN
+            self.top = float(table.min_y.min()) - self.MARGIN
+            right = float(table.max_x.max()) + self.MARGIN
+            bottom = float(table.max_y.max()) + self.MARGIN
+        else:
+            self.left = self.top = right = bottom = 0.0
+
+        # Aims for about one segment per cell
+        width = max(right - self.left, 1.0)
+        height = max(bottom - self.top, 1.0)
+        cell_size = math.sqrt(width * height / max(len(table), 1))
+        self.cell_size = max(cell_size, self.MIN_CELL_SIZE)
+
+        self.columns = int(width // self.cell_size) + 1
+        self.rows = int(height // self.cell_size) + 1
+        self.right = self.left + self.columns * self.cell_size
+        self.bottom = self.top + self.rows * self.cell_size
+
+        self.cells = [[] for _ in range(self.columns * self.rows)]
+        for index in range(len(self.segments)):
+            for cell in self.segment_cells(table, index):
+                self.cells[cell].append(index)
+
+    def column_of(self, x):
+        column = int((x - self.left) // self.cell_size)
+        return min(max(column, 0), self.columns - 1)
+
+    def row_of(self, y):
+        row = int((y - self.top) // self.cell_size)
+        return min(max(row, 0), self.rows - 1)
+
+    def segment_cells(self, table, index):
+        """Returns the index of every cell that a segment passes through.
+
+        Works one column at a time, using the part of the segment inside
+        that column.  The rows are padded a little, so that segments
+        passing exactly through a corner end up in every cell touching it.
+        """
+        x1 = table.x1[index]
+        y1 = table.y1[index]
+        delta_x = table.delta_x[index]
+        delta_y = table.delta_y[index]
+        padding = RAY_EPSILON * 2
+
+        cells = []
+        first_column = self.column_of(table.min_x[index] - padding)
+        last_column = self.column_of(table.max_x[index] + padding)
+        for column in range(first_column, last_column + 1):
+            if delta_x == 0.0:
+                low_y = table.min_y[index]
+                high_y = table.max_y[index]
+            else:
+                column_left = self.left + column * self.cell_size - padding
+                column_right = column_left + self.cell_size + padding * 2
+                u_1 = min(max((column_left - x1) / delta_x, 0.0), 1.0)
+                u_2 = min(max((column_right - x1) / delta_x, 0.0), 1.0)
+                low_y, high_y = min_and_max(y1 + u_1 * delta_y, y1 + u_2 * delta_y)
+
+            for row in range(self.row_of(low_y - padding), self.row_of(high_y + padding) + 1):
+                cells.append(row * self.columns + column)
+
+        return cells
+
+    def segments_near(self, segment, padding=0.0):
+        """Returns the segments that pass through any of the cells touched by
+        segment's bounding box, in their original order.  The box can be
+        grown by padding on every side.
+
+        Anything that could collide with segment is included, along with a
+        few nearby segments that don't.
+        """
+        min_x, max_x = min_and_max(segment.point1[0], segment.point2[0])
+        min_y, max_y = min_and_max(segment.point1[1], segment.point2[1])
+        min_x -= padding
+        min_y -= padding
+        max_x += padding
+        max_y += padding
+        if (max_x < self.left or min_x > self.right or
+                max_y < self.top or min_y > self.bottom):
+            return []
+
+        first_column = self.column_of(min_x)
+        last_column = self.column_of(max_x)
+        first_row = self.row_of(min_y)
+        last_row = self.row_of(max_y)
+
+        # The usual case of a short move that stays inside one cell
+        if first_column == last_column and first_row == last_row:
+            indices = self.cells[first_row * self.columns + first_column]
+        else:
+            indices = set()
+            for row in range(first_row, last_row + 1):
+                for column in range(first_column, last_column + 1):
+                    indices.update(self.cells[row * self.columns + column])
+            indices = sorted(indices)
+
+        return [self.segments[index] for index in indices]
+
+    def closest_ray_hit(self, ray):
+        """Same as closest_ray_hit(ray, segments), but only looks at the
+        segments in the cells that the ray passes through.
+        """
+        origin_x, origin_y = ray.origin
+        delta_x = ray.delta_x
+        delta_y = ray.delta_y
+
+        # Where the ray enters and leaves the grid
+        t_enter = 0.0
+        t_leave = math.inf
+        for origin, delta, low, high in ((origin_x, delta_x, self.left, self.right),
+                                         (origin_y, delta_y, self.top, self.bottom)):
+            if delta == 0.0:
+                if not low <= origin <= high:
+                    return None
+            else:
+                t_1 = (low - origin) / delta
+                t_2 = (high - origin) / delta
+                t_enter = max(t_enter, min(t_1, t_2))
+                t_leave = min(t_leave, max(t_1, t_2))
+        if t_enter > t_leave:
+            return None
+
+        column = self.column_of(origin_x + delta_x * t_enter)
+        row = self.row_of(origin_y + delta_y * t_enter)
+
+        # t_next is how far along the ray the next column or row starts,
+        # and t_step is how far apart columns or rows are along the ray
+        if delta_x > 0.0:
+            step_column = 1
+            t_next_column = (self.left + (column + 1) * self.cell_size - origin_x) / delta_x
+            t_step_column = self.cell_size / delta_x
+        elif delta_x < 0.0:
+            step_column = -1
+            t_next_column = (self.left + column * self.cell_size - origin_x) / delta_x
+            t_step_column = -self.cell_size / delta_x
+        else:
+            step_column = 0
+            t_next_column = math.inf
+            t_step_column = 0.0
+
+        if delta_y > 0.0:
+            step_row = 1
+            t_next_row = (self.top + (row + 1) * self.cell_size - origin_y) / delta_y
+            t_step_row = self.cell_size / delta_y
+        elif delta_y < 0.0:
+            step_row = -1
+            t_next_row = (self.top + row * self.cell_size - origin_y) / delta_y
+            t_step_row = -self.cell_size / delta_y
+        else:
+            step_row = 0
+            t_next_row = math.inf
+            t_step_row = 0.0
+
+        closest_t = math.inf
+        closest = -1
+        tested = set()
+        while 0 <= column < self.columns and 0 <= row < self.rows:
+            for index in self.cells[row * self.columns + column]:
+                if index in tested:
+                    continue
+                tested.add(index)
+
+                intersection = ray_segment_intersection(ray, self.segments[index])
+                if intersection:
+                    t = intersection[0]
+                    # Ties go to the earliest segment, like the linear scan
+                    if t < closest_t or (t == closest_t and index < closest):
+                        closest_t = t
+                        closest = index
+
+            # Nothing in a later cell can be closer than a hit in this one
+            t_cell_end = min(t_next_column, t_next_row)
+            if closest != -1 and closest_t <= t_cell_end:
+                break
+
+            if t_next_column < t_next_row:
+                column += step_column
+                t_next_column += t_step_column
+            else:
+                row += step_row
+                t_next_row += t_step_row
+
+        if closest == -1:
+            return None
+        return self.segments[closest], closest_t
+
+
+class RayHit:
+    """Where a ray hit a segment.  distance is measured from the start of
+    the ray.
+    """
+    def __init__(self, segment, point, distance):
+        self.segment = segment
+        self.point = point
+        self.distance = distance
+        self.color = segment.color
+
+
+class RayCaster:
+    """Answers every ray query against one set of segments, such as a
+    level's walls.
+
+    A query returns a RayHit, or None if the ray hits nothing.  Answers are
+    remembered, so asking for the same ray twice only traces it once.  They
+    are kept until a query comes from a different position (usually the
+    next frame the player moves), since a ray from a new spot is never
+    going to match an old one.
+
+    grid and table are optional, and make closest hit queries faster.
+    """
+    CLOSEST = 0
+    FARTHEST = 1
+    ANY = 2
+
+    # Turning on the spot asks for new angles every frame without moving,
+    # so the memo is also dropped once it gets this big
+    MAX_MEMO_SIZE = 4096
+
+    def __init__(self, segments, grid=None, table=None):
+        self.segments = tuple(segments)
+        self.grid = grid
+        self.table = table
+
+        self.position = None
+        self.memo = {}
+
+    def remember(self, position):
+        """Starts a new memo if position isn't the one being remembered."""
+        if position != self.position or len(self.memo) > self.MAX_MEMO_SIZE:
+            self.position = position
+            self.memo = {}
+
+    def trace(self, ray, mode):
+        if mode == self.FARTHEST:
+            return farthest_ray_hit(ray, self.segments)
+
+        # Stopping at the first hit beats walking the grid, since a level
+        # only has a few dozen segments and rays nearly always hit one
+        if mode == self.ANY:
+            return any_ray_hit(ray, self.segments)
+
+        if self.grid:
+            return self.grid.closest_ray_hit(ray)
+        return closest_ray_hit(ray, self.segments)
+
+    def cast(self, position, angle, mode=CLOSEST):
+        """Casts one ray from position with an angle of angle (in radians)."""
+        self.remember(position)
+
+        key = (mode, angle)
+        if key not in self.memo:
+            ray = angle_ray(position, angle)
+            hit = self.trace(ray, mode)
+            if hit:
+                self.memo[key] = RayHit(hit[0], ray.point_at(hit[1]), hit[1])
+            else:
+                self.memo[key] = None
+
+        return self.memo[key]
+
+    def cast_all(self, position, angles, mode=CLOSEST):
+        """Casts one ray from position per angle in angles, and returns a
+        list of the results.  Closest hit rays that haven't been cast yet
+        are all traced at once.
+        """
+        self.remember(position)
+
+        if mode == self.CLOSEST and self.table is not None:
+            new_angles = [angle for angle in angles if (mode, angle) not in self.memo]
+            if new_angles:
+                indices, points, distances = cast_rays(position, new_angles, self.table)
+                for angle, index, point, hit_distance in zip(new_angles, indices.tolist(),
+                                                             points.tolist(), distances.tolist()):
+                    if index == -1:
+                        self.memo[(mode, angle)] = None
+                    else:
+                        self.memo[(mode, angle)] = RayHit(self.segments[index], tuple(point), hit_distance)
+
+        return [self.cast(position, angle, mode) for angle in angles]
+
+
 def regular_polygon(sides, radius, center_point, angle=0.0):
     """Returns a regular Polygon with a given amount of sign.
 
@@ -442,6 +1306,134 @@ def segments_collide(segment_1, segment_2):
     return False
 
 
+# Circles that run into a wall are left this far from it, so that rounding
+# never leaves them overlapping it
+CIRCLE_SKIN = 0.01
+
+
+def circle_segment_impact(position, difference, radius, segment):
+    """Returns a (t, normal_x, normal_y) tuple for when a circle centered at
+    position, moving by difference, first touches segment, or None if it
+    doesn't touch it.
+
+    The circle touches it at position + t * difference, where t is from 0
+    to 1.  The normal is a unit vector pointing from the segment to the
+    circle's center at that moment.  A circle that is already touching only
+    counts as hitting it if it moves towards it.
+    """
+    x, y = position
+    delta_x, delta_y = difference
+    x1, y1 = segment.point1
+
+    # Already touching?
+    if segment.length:
+        u = ((x - x1) * segment.delta_x + (y - y1) * segment.delta_y) / segment.length ** 2
+        u = min(max(u, 0.0), 1.0)
+    else:
+        u = 0.0
+    away_x = x - (x1 + segment.delta_x * u)
+    away_y = y - (y1 + segment.delta_y * u)
+    away = math.hypot(away_x, away_y)
+    if away < radius + CIRCLE_SKIN:
+        if away == 0.0:
+            return None
+        normal_x = away_x / away
+        normal_y = away_y / away
+        if delta_x * normal_x + delta_y * normal_y < 0.0:
+            return 0.0, normal_x, normal_y
+        return None
+
+    # The flat side of the segment.  If the circle hits it, that is always
+    # before it could hit either end.
+    if segment.length:
+        normal_x = -segment.delta_y / segment.length
+        normal_y = segment.delta_x / segment.length
+        side = (x - x1) * normal_x + (y - y1) * normal_y
+        if side < 0.0:
+            normal_x = -normal_x
+            normal_y = -normal_y
+            side = -side
+
+        # Circles beside the segment rather than in front of it (side is
+        # less than radius) can only run into its ends
+        speed = delta_x * normal_x + delta_y * normal_y
+        if speed < 0.0 and side >= radius:
+            t = (side - radius) / -speed
+            if t <= 1.0:
+                hit_x = x + delta_x * t - x1
+                hit_y = y + delta_y * t - y1
+                u = (hit_x * segment.delta_x + hit_y * segment.delta_y) / segment.length ** 2
+                if 0.0 <= u <= 1.0:
+                    return t, normal_x, normal_y
+
+    # The ends, as circles of the same radius that the center can't enter
+    impact = None
+    length_squared = delta_x * delta_x + delta_y * delta_y
+    for end_x, end_y in (segment.point1, segment.point2):
+        from_end_x = x - end_x
+        from_end_y = y - end_y
+        towards = from_end_x * delta_x + from_end_y * delta_y
+        if length_squared == 0.0 or towards >= 0.0:
+            continue
+
+        discriminant = towards * towards - length_squared * (
+            from_end_x * from_end_x + from_end_y * from_end_y - radius * radius)
+        if discriminant < 0.0:
+            continue
+
+        t = (-towards - math.sqrt(discriminant)) / length_squared
+        if t <= 1.0 and (not impact or t < impact[0]):
+            normal_x = (from_end_x + delta_x * t) / radius
+            normal_y = (from_end_y + delta_y * t) / radius
+            impact = (t, normal_x, normal_y)
+
+    return impact
+
+
+def slide_circle(position, difference, radius, grid, bounces=3):
+    """Moves a circle centered at position by difference, stopping at the
+    first segment in grid (a SegmentGrid) that it runs into and sliding the
+    rest of the way along it.  Returns the circle's new position.
+
+    Sliding can run into another segment, which is slid along in turn, up
+    to bounces times.
+    """
+    x, y = position
+    delta_x, delta_y = difference
+
+    for bounce in range(bounces):
+        if delta_x == 0.0 and delta_y == 0.0:
+            break
+
+        path = Segment((x, y), (x + delta_x, y + delta_y))
+        impact = None
+        for segment in grid.segments_near(path, radius + CIRCLE_SKIN):
+            segment_impact = circle_segment_impact((x, y), (delta_x, delta_y), radius, segment)
+            if segment_impact and (not impact or segment_impact[0] < impact[0]):
+                impact = segment_impact
+
+        if not impact:
+            x += delta_x
+            y += delta_y
+            break
+
+        # Moves up to the wall, stopping a little short.  Backing up along
+        # the path can't run into anything, since it was just travelled.
+        t, normal_x, normal_y = impact
+        stop = max(t - CIRCLE_SKIN / 2 / math.hypot(delta_x, delta_y), 0.0)
+        x += delta_x * stop
+        y += delta_y * stop
+
+        # What is left of the movement, minus the part going into the wall
+        delta_x *= 1.0 - t
+        delta_y *= 1.0 - t
+        into_wall = delta_x * normal_x + delta_y * normal_y
+        delta_x -= into_wall * normal_x
+        delta_y -= into_wall * normal_y
+
+    return x, y
+
+
 def inverse(num):
     """Returns the inverse of a number.
     Interestingly, Python automatically handles 1.0 / inf.
@@ -485,26 +1477,230 @@ def point_and_segment(point, segment):
 
 
 def point_in_polygon(point, polygon):
+    # Counts how many edges a diagonal ray crosses
+    ray = Ray(point, 1.0, 1.0)
     total = 0
-    line = Line(point, 1.0)
-    angle = slope_to_angle(line.slope)
     for segment in polygon.segments:
-        intersection = line_segment_intersection(line, segment)
-
-        if intersection:
-            check_angle = angle_between(point, intersection)
-            if angles_close(angle, check_angle):
-                total += 1
+        if ray_segment_intersection(ray, segment):
+            total += 1
 
     if total % 2 == 0:
         return False
     return True
 
 
+class PolygonMask:
+    """Answers which of a list of polygons a point is in with a lookup
+    instead of a point_in_polygon() per polygon.
+
+    Only the box around the polygons (clipped to width by height) is
+    rasterized.  Each pixel of that raster holds the number of the polygon
+    its whole area is inside (starting from 1), 0 if it is inside none, or
+    AMBIGUOUS if an edge passes close by or polygons overlap there.  Those
+    pixels, and points whose diagonal ray passes through a corner (which
+    point_in_polygon() counts twice), are answered with point_in_polygon()
+    so the results always match it exactly.
+
+    Points outside the box are in none of the polygons, since the diagonal
+    ray from them crosses each polygon an even number of times unless it
+    passes through a corner, which is already checked for.  Points outside
+    width by height always use point_in_polygon().
+    """
+    AMBIGUOUS = 255
+
+    # Pixels with their center this close to an edge can't be trusted.
+    # Just over half the diagonal of a pixel.
+    EDGE_DISTANCE = 0.75
+    DIAGONAL_EPSILON = 0.001
+
+    def __init__(self, polygons, width, height, raster=None):
+        """raster can be given to reuse one made earlier for the same
+        polygons, instead of making it again.
+        """
+        self.polygons = tuple(polygons)
+        self.width = width
+        self.height = height
+
+        points = [point for polygon in self.polygons for point in polygon.point_list]
+        if points:
+            x_values = [point[0] for point in points]
+            y_values = [point[1] for point in points]
+            self.left = min(max(int(math.floor(min(x_values) - self.EDGE_DISTANCE)), 0), width)
+            self.top = min(max(int(math.floor(min(y_values) - self.EDGE_DISTANCE)), 0), height)
+            self.right = max(min(int(max(x_values) + self.EDGE_DISTANCE) + 1, width), self.left)
+            self.bottom = max(min(int(max(y_values) + self.EDGE_DISTANCE) + 1, height), self.top)
+        else:
+            self.left = self.top = self.right = self.bottom = 0
+
+        if raster is None:
+            self.raster = numpy.zeros((self.bottom - self.top, self.right - self.left), numpy.uint8)
+            self.rasterize()
+        else:
+            self.raster = raster
+
+        diagonals = [point[0] - point[1] for point in points]
+        self.diagonal_list = sorted(diagonals)
+        self.diagonals = numpy.array(self.diagonal_list, dtype=float)
+
+    def rasterize(self):
+        overlaps = numpy.zeros(self.raster.shape, numpy.uint8)
+        for number, polygon in enumerate(self.polygons, 1):
+            # Only the pixels around this polygon can be inside it
+            left = max(int(math.floor(min(point[0] for point in polygon.point_list))), self.left)
+            top = max(int(math.floor(min(point[1] for point in polygon.point_list))), self.top)
+            right = min(int(max(point[0] for point in polygon.point_list)) + 1, self.right)
+            bottom = min(int(max(point[1] for point in polygon.point_list)) + 1, self.bottom)
+            if left >= right or top >= bottom:
+                continue
+            center_x = numpy.arange(left, right) + 0.5
+            center_y = (numpy.arange(top, bottom) + 0.5)[:, numpy.newaxis]
+
+            # Counts the edges crossed by a ray going right from each center
+            inside = numpy.zeros((bottom - top, right - left), bool)
+            for segment in polygon.segments:
+                (x1, y1), (x2, y2) = segment.point1, segment.point2
+                if y1 == y2:
+                    continue
+                spans_row = (y1 > center_y) != (y2 > center_y)
+                crossing_x = x1 + (center_y - y1) * (x2 - x1) / (y2 - y1)
+                inside ^= spans_row & (center_x < crossing_x)
+
+            rows = slice(top - self.top, bottom - self.top)
+            columns = slice(left - self.left, right - self.left)
+            self.raster[rows, columns][inside] = number
+            overlaps[rows, columns] += inside
+
+        self.raster[overlaps > 1] = self.AMBIGUOUS
+        for polygon in self.polygons:
+            for segment in polygon.segments:
+                self.mark_near(segment)
+
+    def mark_near(self, segment):
+        """Marks every pixel whose center is near segment as AMBIGUOUS."""
+        min_x, max_x = min_and_max(segment.point1[0], segment.point2[0])
+        min_y, max_y = min_and_max(segment.point1[1], segment.point2[1])
+        left = max(int(math.floor(min_x - self.EDGE_DISTANCE)), self.left)
+        right = min(int(max_x + self.EDGE_DISTANCE) + 1, self.right)
+        top = max(int(math.floor(min_y - self.EDGE_DISTANCE)), self.top)
+        bottom = min(int(max_y + self.EDGE_DISTANCE) + 1, self.bottom)
+        if left >= right or top >= bottom:
+            return
+
+        to_start_x = numpy.arange(left, right) + 0.5 - segment.point1[0]
+        to_start_y = (numpy.arange(top, bottom) + 0.5 - segment.point1[1])[:, numpy.newaxis]
+        if segment.length:
+            u = (to_start_x * segment.delta_x + to_start_y * segment.delta_y) / segment.length ** 2
+            u = numpy.clip(u, 0.0, 1.0)
+        else:
+            u = 0.0
+        distances = numpy.hypot(to_start_x - u * segment.delta_x, to_start_y - u * segment.delta_y)
+
+        region = self.raster[top - self.top:bottom - self.top, left - self.left:right - self.left]
+        region[distances <= self.EDGE_DISTANCE] = self.AMBIGUOUS
+
+    def lookup(self, points):
+        """Returns a (points, values, uncertain) tuple, where points is
+        points as an N by 2 array, values holds the raster value under each
+        point (0 outside the box) and uncertain is True for the points that
+        need to be checked with point_in_polygon().
+        """
+        points = numpy.asarray(points, dtype=float).reshape(-1, 2)
+        x = points[:, 0]
+        y = points[:, 1]
+
+        inside_area = (x >= 0.0) & (x < self.width) & (y >= 0.0) & (y < self.height)
+        inside_box = (x >= self.left) & (x < self.right) & (y >= self.top) & (y < self.bottom)
+        columns = numpy.where(inside_box, x - self.left, 0.0).astype(int)
+        rows = numpy.where(inside_box, y - self.top, 0.0).astype(int)
+        values = numpy.zeros(len(points), numpy.uint8)
+        if self.raster.size:
+            values = numpy.where(inside_box, self.raster[rows, columns], 0).astype(numpy.uint8)
+
+        # Distance (along x - y) to the closest corner diagonal
+        near_corner = numpy.zeros(len(points), bool)
+        if len(self.diagonals):
+            differences = x - y
+            after = numpy.searchsorted(self.diagonals, differences).clip(1, len(self.diagonals) - 1)
+            if len(self.diagonals) == 1:
+                closest = numpy.abs(differences - self.diagonals[0])
+            else:
+                closest = numpy.minimum(numpy.abs(differences - self.diagonals[after - 1]),
+                                        numpy.abs(differences - self.diagonals[after]))
+            near_corner = closest <= self.DIAGONAL_EPSILON
+
+        uncertain = ~inside_area | near_corner | (values == self.AMBIGUOUS)
+        return points, values, uncertain
+
+    def value_at(self, point):
+        """Returns the raster value under a single point (0 outside the
+        box), or None if it needs to be checked with point_in_polygon().
+        Same as lookup(), but quicker for one point.
+        """
+        x, y = point
+        if not (0.0 <= x < self.width and 0.0 <= y < self.height):
+            return None
+
+        difference = x - y
+        after = bisect.bisect(self.diagonal_list, difference)
+        for index in (after - 1, after):
+            if 0 <= index < len(self.diagonal_list):
+                if abs(difference - self.diagonal_list[index]) <= self.DIAGONAL_EPSILON:
+                    return None
+
+        if not (self.left <= x < self.right and self.top <= y < self.bottom):
+            return 0
+
+        value = self.raster.item(int(y) - self.top, int(x) - self.left)
+        if value == self.AMBIGUOUS:
+            return None
+        return value
+
+    def all_indices_at(self, point):
+        """Returns a tuple of the indices of every polygon that point is in.
+        Polygons can only share AMBIGUOUS pixels, so this is never more
+        than one polygon anywhere else.
+        """
+        value = self.value_at(point)
+        if value is None:
+            return tuple(index for index, polygon in enumerate(self.polygons)
+                         if point_in_polygon(point, polygon))
+
+        if value:
+            return value - 1,
+        return ()
+
+    def index_at(self, point):
+        """Returns the index of the first polygon that point is in, or -1
+        if it is in none of them.
+        """
+        indices = self.all_indices_at(point)
+        if indices:
+            return indices[0]
+        return -1
+
+    def indices_at(self, points):
+        """Batched version of index_at().  points is a sequence of points or
+        an N by 2 array, and the result is an array of indices.
+        """
+        points, values, uncertain = self.lookup(points)
+
+        indices = values.astype(int) - 1
+        for number in numpy.flatnonzero(uncertain):
+            point = tuple(points[number].tolist())
+            indices[number] = -1
+            for index, polygon in enumerate(self.polygons):
+                if point_in_polygon(point, polygon):
+                    indices[number] = index
+                    break
+
+        return indices
+
+
 SCREEN_CORNERS = ((0, 0), (constants.SCREEN_WIDTH, 0),
                   (constants.SCREEN_WIDTH, constants.SCREEN_WIDTH),
                   (0, constants.SCREEN_WIDTH))
 SCREEN_POLYGON = Polygon(SCREEN_CORNERS)
+SCREEN_RAYS = RayCaster(SCREEN_POLYGON.segments)
 
 
 def farthest_wall_intersection(position, polygon, angle):
@@ -513,21 +1709,11 @@ def farthest_wall_intersection(position, polygon, angle):
 
     The ray starts at position and has an angle of angle (in radians).
     """
-    line = Line(position, angle_to_slope(angle))
-    farthest_distance = 0.0
-    farthest_intersection = None
-
-    for segment in polygon.segments:
-        intersection = line_segment_intersection(line, segment)
-        if intersection:
-            distance_between = distance(position, intersection)
-            angle_check = angle_between(position, intersection)
-            if distance_between > farthest_distance:
-                if angles_close(angle, angle_check):
-                    farthest_distance = distance_between
-                    farthest_intersection = intersection
-
-    return farthest_intersection
+    ray = angle_ray(position, angle)
+    hit = farthest_ray_hit(ray, polygon.segments)
+    if hit:
+        return ray.point_at(hit[1])
+    return None
 
 
 def screen_edge(point, angle, offset=(0, 0)):
@@ -539,4 +1725,7 @@ def screen_edge(point, angle, offset=(0, 0)):
     if offset != (0, 0):
         point = utility.add_tuples(point, offset)
 
-    return farthest_wall_intersection(point, SCREEN_POLYGON, angle)
+    hit = SCREEN_RAYS.cast(point, angle, RayCaster.FARTHEST)
+    if hit:
+        return hit.point
+    return None
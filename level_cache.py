@@ -0,0 +1,209 @@
+"""Saves every level, fully built, to a file so the game can load them
+instead of building them each time it is played.
+
+The file is rebuilt whenever levels.py, geometry.py, constants.py or
+utility.py change, since any of them can change what a level is built
+into (constants.py sets the colors and the size of the goal mask).  To
+rebuild it by hand, with one process per level:  python level_cache.py
+"""
+import hashlib
+import mmap
+import multiprocessing
+import os
+import struct
+import sys
+
+import numpy
+
+import constants
+import geometry
+import levels
+import utility
+
+CACHE_PATH = "compiled_levels.bin"
+MAGIC = b"SLLC"
+VERSION = 3
+
+# magic, version, source hash, level count.  Followed by level count + 1
+# offsets, where level n is stored from offset n up to offset n + 1.
+HEADER = struct.Struct("<4sI20sI")
+OFFSET = numpy.dtype("<u8")
+# start x, start y, start orientation, collision polygon count, goal count,
+# player collision segment count
+LEVEL = struct.Struct("<dddIII")
+# point count, closed
+POLYGON = struct.Struct("<I?")
+# point count, red, green, blue
+GOAL = struct.Struct("<IBBB")
+# goal mask raster rows, columns
+RASTER = struct.Struct("<II")
+
+
+def source_hash():
+    """Returns a hash of the code that builds levels."""
+    sha = hashlib.sha1()
+    for module in (levels, geometry, constants, utility):
+        with open(module.__file__, "rb") as file:
+            sha.update(file.read())
+    return sha.digest()
+
+
+def pack_points(points):
+    return numpy.array(points, dtype="<f8").tobytes()
+
+
+def encode_level(level):
+    """Returns a level as bytes, in the format read by decode_level()."""
+    level.build_player_collision()
+
+    parts = [LEVEL.pack(level.start_position[0], level.start_position[1], level.start_orientation,
+                        len(level.collision), len(level.goals), len(level.player_collision))]
+
+    for polygon in level.collision:
+        parts.append(POLYGON.pack(len(polygon.point_list), polygon.closed))
+        parts.append(pack_points(polygon.point_list))
+        parts.append(bytes(channel for segment in polygon.segments for channel in segment.color))
+
+    for polygon in level.goals:
+        parts.append(GOAL.pack(len(polygon.point_list), *polygon.color))
+        parts.append(pack_points(polygon.point_list))
+
+    parts.append(pack_points([segment.point1 + segment.point2 for segment in level.player_collision]))
+    parts.append(RASTER.pack(*level.goal_mask.raster.shape))
+    parts.append(level.goal_mask.raster.tobytes())
+    return b"".join(parts)
+
+
+def unpack_points(data, offset, count):
+    """Returns a tuple of count points read from data, and the offset of
+    whatever comes after them.
+    """
+    values = numpy.frombuffer(data, "<f8", count * 2, offset).tolist()
+    points = tuple(zip(values[0::2], values[1::2]))
+    return points, offset + count * 16
+
+
+def decode_level(data, offset):
+    """Returns the Level stored at offset in data, and the offset of
+    whatever comes after it.
+    """
+    (start_x, start_y, start_orientation,
+     polygon_count, goal_count, player_collision_count) = LEVEL.unpack_from(data, offset)
+    offset += LEVEL.size
+
+    collision = []
+    for _ in range(polygon_count):
+        point_count, closed = POLYGON.unpack_from(data, offset)
+        offset += POLYGON.size
+        points, offset = unpack_points(data, offset, point_count)
+
+        polygon = geometry.Polygon(points, closed)
+        colors = data[offset:offset + len(polygon.segments) * 3]
+        offset += len(colors)
+        polygon.set_colors(tuple(tuple(colors[index:index + 3]) for index in range(0, len(colors), 3)))
+        collision.append(polygon)
+
+    goals = []
+    for _ in range(goal_count):
+        point_count, red, green, blue = GOAL.unpack_from(data, offset)
+        offset += GOAL.size
+        points, offset = unpack_points(data, offset, point_count)
+
+        polygon = geometry.Polygon(points)
+        polygon.color = (red, green, blue)
+        goals.append(polygon)
+
+    ends, offset = unpack_points(data, offset, player_collision_count * 2)
+    player_collision = [geometry.Segment(ends[index], ends[index + 1])
+                        for index in range(0, len(ends), 2)]
+
+    rows, columns = RASTER.unpack_from(data, offset)
+    offset += RASTER.size
+    raster = numpy.frombuffer(data, numpy.uint8, rows * columns, offset).reshape((rows, columns))
+    offset += rows * columns
+
+    level = levels.Level(tuple(collision), tuple(goals), (start_x, start_y), start_orientation, raster)
+    level.player_collision = player_collision
+    return level, offset
+
+
+def compile_level(level_num):
+    """Builds and encodes one level.  Runs in a worker process."""
+    return encode_level(levels.level_generators[level_num]())
+
+
+def write_cache(encoded_levels, path=CACHE_PATH):
+    """Saves a list of encode_level() results to path.  The file is
+    written under another name first, so that anything reading the old
+    one is never left with half a file.
+    """
+    offsets = numpy.zeros(len(encoded_levels) + 1, OFFSET)
+    offsets[0] = HEADER.size + offsets.nbytes
+    offsets[1:] = offsets[0] + numpy.cumsum([len(data) for data in encoded_levels])
+
+    temporary_path = path + ".tmp"
+    with open(temporary_path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, source_hash(), len(encoded_levels)))
+        file.write(offsets.tobytes())
+        for data in encoded_levels:
+            file.write(data)
+    os.replace(temporary_path, path)
+
+
+class CompiledLevels:
+    """A saved level file, memory-mapped so that each level is only read
+    from disk when it is needed.
+    """
+    def __init__(self, path=CACHE_PATH):
+        with open(path, "rb") as file:
+            self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, saved_hash, level_count = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION or saved_hash != source_hash():
+            raise ValueError("%s is out of date" % path)
+
+        self.offsets = numpy.frombuffer(self.map, OFFSET, level_count + 1, HEADER.size).tolist()
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def level(self, level_num):
+        return decode_level(self.map, self.offsets[level_num])[0]
+
+
+def open_cache(path=CACHE_PATH):
+    """Returns the CompiledLevels at path, or None if there aren't any or
+    they were built by different code.
+    """
+    try:
+        compiled = CompiledLevels(path)
+    except (OSError, ValueError, struct.error):
+        return None
+
+    if len(compiled) != len(levels.level_generators):
+        return None
+    return compiled
+
+
+def save_all(path=CACHE_PATH):
+    """Builds every level one at a time and saves them to path."""
+    write_cache([compile_level(level_num) for level_num in range(len(levels.level_generators))], path)
+
+
+def rebuild(path=CACHE_PATH):
+    """Builds every level, one per process, and saves them to path."""
+    pool = multiprocessing.Pool()
+    try:
+        encoded_levels = pool.map(compile_level, range(len(levels.level_generators)))
+    finally:
+        pool.close()
+        pool.join()
+
+    write_cache(encoded_levels, path)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        rebuild(sys.argv[1])
+    else:
+        rebuild()
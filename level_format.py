@@ -0,0 +1,277 @@
+"""Levels described as data instead of code.
+
+A level description is a dictionary that can be saved as JSON:
+
+    {"start": [250, 250],
+     "orientation": -1.5708,
+     "walls": [{"shape": ..., "colors": [[0, 255, 0], ...]}, ...],
+     "goals": [{"shape": ..., "color": [170, 170, 255]}, ...]}
+
+Each wall has one color per segment.  A shape is one of:
+
+    {"points": [[x, y], ...], "closed": true}
+    {"regular": {"sides": 5, "radius": 24, "center": [250, 250], "angle": 0.0}}
+    {"square": {"point1": [x, y], "point2": [x, y], "extend_upwards": false}}
+
+where "closed" is optional and defaults to true, "angle" is optional and
+defaults to 0.0, and the last two are built with geometry.regular_polygon()
+and geometry.two_point_square().
+
+Level packs store many descriptions in a compact binary file.  The file
+starts with an index, so a LevelPack only reads the levels it is asked for.
+
+To save the built-in levels as a pack:  python level_format.py export levels.slp
+To save them as JSON instead:          python level_format.py export levels.json
+To turn JSON into a pack:              python level_format.py pack levels.json levels.slp
+"""
+import json
+import struct
+import sys
+
+import geometry
+import levels
+
+MAGIC = b"SLLP"
+VERSION = 1
+
+# magic, version, level count.  Followed by the index, which holds the
+# offset and size of each level.
+HEADER = struct.Struct("<4sII")
+INDEX_ENTRY = struct.Struct("<QI")
+# start x, start y, start orientation, wall count, goal count
+LEVEL = struct.Struct("<dddHH")
+COLOR = struct.Struct("<BBB")
+
+POINTS_SHAPE = 0
+REGULAR_SHAPE = 1
+SQUARE_SHAPE = 2
+# kind, then for points: closed, point count
+SHAPE = struct.Struct("<B")
+POINTS = struct.Struct("<?H")
+POINT = struct.Struct("<dd")
+# sides, radius, center x, center y, angle
+REGULAR = struct.Struct("<Hdddd")
+# point 1 x, point 1 y, point 2 x, point 2 y, extend upwards
+SQUARE = struct.Struct("<dddd?")
+
+
+def build_shape(shape):
+    """Returns the geometry.Polygon for a shape description."""
+    if "regular" in shape:
+        regular = shape["regular"]
+        return geometry.regular_polygon(regular["sides"], regular["radius"],
+                                        tuple(regular["center"]), regular.get("angle", 0.0))
+
+    if "square" in shape:
+        square = shape["square"]
+        return geometry.two_point_square(tuple(square["point1"]), tuple(square["point2"]),
+                                         square["extend_upwards"])
+
+    return geometry.Polygon([tuple(point) for point in shape["points"]], shape.get("closed", True))
+
+
+def build_level(description):
+    """Returns the levels.Level for a level description."""
+    walls = []
+    for wall in description["walls"]:
+        polygon = build_shape(wall["shape"])
+        if len(wall["colors"]) != len(polygon.segments):
+            raise ValueError("a wall with %i segments has %i colors" %
+                             (len(polygon.segments), len(wall["colors"])))
+        polygon.set_colors([tuple(color) for color in wall["colors"]])
+        walls.append(polygon)
+
+    goals = []
+    for goal in description["goals"]:
+        polygon = build_shape(goal["shape"])
+        polygon.color = tuple(goal["color"])
+        goals.append(polygon)
+
+    return levels.Level(tuple(walls), tuple(goals), tuple(description["start"]),
+                        description["orientation"])
+
+
+def describe_shape(polygon):
+    return {"points": [list(point) for point in polygon.point_list], "closed": polygon.closed}
+
+
+def describe_level(level):
+    """Returns the description of a built levels.Level.  Shapes are always
+    described by their points.
+    """
+    return {"start": list(level.start_position),
+            "orientation": level.start_orientation,
+            "walls": [{"shape": describe_shape(polygon),
+                       "colors": [list(segment.color) for segment in polygon.segments]}
+                      for polygon in level.collision],
+            "goals": [{"shape": describe_shape(polygon), "color": list(polygon.color)}
+                      for polygon in level.goals]}
+
+
+def encode_shape(shape):
+    if "regular" in shape:
+        regular = shape["regular"]
+        center = regular["center"]
+        return SHAPE.pack(REGULAR_SHAPE) + REGULAR.pack(regular["sides"], regular["radius"],
+                                                        center[0], center[1],
+                                                        regular.get("angle", 0.0))
+
+    if "square" in shape:
+        square = shape["square"]
+        return SHAPE.pack(SQUARE_SHAPE) + SQUARE.pack(square["point1"][0], square["point1"][1],
+                                                      square["point2"][0], square["point2"][1],
+                                                      square["extend_upwards"])
+
+    points = shape["points"]
+    parts = [SHAPE.pack(POINTS_SHAPE), POINTS.pack(shape.get("closed", True), len(points))]
+    parts.extend(POINT.pack(point[0], point[1]) for point in points)
+    return b"".join(parts)
+
+
+def encode_level(description):
+    """Returns a level description as bytes, in the format read by
+    decode_level().
+    """
+    parts = [LEVEL.pack(description["start"][0], description["start"][1],
+                        description["orientation"],
+                        len(description["walls"]), len(description["goals"]))]
+
+    for wall in description["walls"]:
+        parts.append(encode_shape(wall["shape"]))
+        parts.append(struct.pack("<H", len(wall["colors"])))
+        parts.extend(COLOR.pack(*color) for color in wall["colors"])
+
+    for goal in description["goals"]:
+        parts.append(encode_shape(goal["shape"]))
+        parts.append(COLOR.pack(*goal["color"]))
+
+    return b"".join(parts)
+
+
+def decode_shape(data, offset):
+    """Returns a shape description read from data, and the offset of
+    whatever comes after it.
+    """
+    kind, = SHAPE.unpack_from(data, offset)
+    offset += SHAPE.size
+
+    if kind == REGULAR_SHAPE:
+        sides, radius, center_x, center_y, angle = REGULAR.unpack_from(data, offset)
+        shape = {"regular": {"sides": sides, "radius": radius,
+                             "center": [center_x, center_y], "angle": angle}}
+        return shape, offset + REGULAR.size
+
+    if kind == SQUARE_SHAPE:
+        x1, y1, x2, y2, extend_upwards = SQUARE.unpack_from(data, offset)
+        shape = {"square": {"point1": [x1, y1], "point2": [x2, y2],
+                            "extend_upwards": extend_upwards}}
+        return shape, offset + SQUARE.size
+
+    if kind != POINTS_SHAPE:
+        raise ValueError("unknown shape kind %i" % kind)
+
+    closed, count = POINTS.unpack_from(data, offset)
+    offset += POINTS.size
+    points = [list(POINT.unpack_from(data, offset + index * POINT.size)) for index in range(count)]
+    return {"points": points, "closed": closed}, offset + count * POINT.size
+
+
+def decode_level(data):
+    """Returns the level description stored in data."""
+    start_x, start_y, orientation, wall_count, goal_count = LEVEL.unpack_from(data, 0)
+    offset = LEVEL.size
+
+    walls = []
+    for _ in range(wall_count):
+        shape, offset = decode_shape(data, offset)
+        color_count, = struct.unpack_from("<H", data, offset)
+        offset += 2
+        colors = [list(COLOR.unpack_from(data, offset + index * COLOR.size))
+                  for index in range(color_count)]
+        offset += color_count * COLOR.size
+        walls.append({"shape": shape, "colors": colors})
+
+    goals = []
+    for _ in range(goal_count):
+        shape, offset = decode_shape(data, offset)
+        color = list(COLOR.unpack_from(data, offset))
+        offset += COLOR.size
+        goals.append({"shape": shape, "color": color})
+
+    return {"start": [start_x, start_y], "orientation": orientation,
+            "walls": walls, "goals": goals}
+
+
+def save_pack(descriptions, path):
+    """Saves a list of level descriptions as a level pack."""
+    encoded_levels = [encode_level(description) for description in descriptions]
+
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, len(encoded_levels)))
+
+        offset = HEADER.size + INDEX_ENTRY.size * len(encoded_levels)
+        for data in encoded_levels:
+            file.write(INDEX_ENTRY.pack(offset, len(data)))
+            offset += len(data)
+
+        for data in encoded_levels:
+            file.write(data)
+
+
+class LevelPack:
+    """A level pack file.  Only the index is read when it is opened, and
+    each level is read from the file when it is asked for.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as file:
+            magic, version, level_count = HEADER.unpack(file.read(HEADER.size))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError("%s is not a version %i level pack" % (path, VERSION))
+
+            index = file.read(INDEX_ENTRY.size * level_count)
+            self.index = [INDEX_ENTRY.unpack_from(index, number * INDEX_ENTRY.size)
+                          for number in range(level_count)]
+
+    def __len__(self):
+        return len(self.index)
+
+    def description(self, level_num):
+        offset, size = self.index[level_num]
+        with open(self.path, "rb") as file:
+            file.seek(offset)
+            return decode_level(file.read(size))
+
+    def level(self, level_num):
+        return build_level(self.description(level_num))
+
+
+def save_json(descriptions, path):
+    with open(path, "w") as file:
+        json.dump(descriptions, file, indent=1)
+
+
+def load_json(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+def export(path):
+    """Saves every built-in level to path, as JSON if path ends in .json
+    and as a level pack otherwise.
+    """
+    descriptions = [describe_level(generate()) for generate in levels.level_generators]
+    if path.endswith(".json"):
+        save_json(descriptions, path)
+    else:
+        save_pack(descriptions, path)
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "export":
+        export(sys.argv[2])
+    elif len(sys.argv) == 4 and sys.argv[1] == "pack":
+        save_pack(load_json(sys.argv[2]), sys.argv[3])
+    else:
+        print("usage: python level_format.py export <file>")
+        print("       python level_format.py pack <json file> <pack file>")
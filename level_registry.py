@@ -0,0 +1,120 @@
+import collections
+import itertools
+import queue
+import threading
+
+import levels
+import level_cache
+
+
+class LevelRegistry:
+    """Every level in the game, each only built when it is first needed.
+
+    Levels come from the level cache if it is up to date, and from their
+    generators otherwise.  Only the max_levels most recently used levels
+    are kept around.  A worker thread builds the levels that will probably
+    be needed next (see prefetch()), and rewrites an out of date cache once
+    it has nothing better to do.
+
+    A level_format.LevelPack can be given to play its levels instead of
+    the built-in ones.  They are read straight from the pack, which is
+    already quick, so the level cache isn't used for them.
+
+    Indexing works like the tuple of levels this replaces.
+    """
+    MAX_LEVELS = 4
+
+    # Jobs with lower numbers are done first
+    PREFETCH = 0
+    SAVE_CACHE = 1
+
+    def __init__(self, path=level_cache.CACHE_PATH, max_levels=MAX_LEVELS, pack=None):
+        self.path = path
+        self.max_levels = max_levels
+        self.pack = pack
+        if pack is not None:
+            self.compiled = None
+        else:
+            self.compiled = level_cache.open_cache(path)
+
+        self.levels = collections.OrderedDict()
+        self.lock = threading.Lock()
+        # Held while building a level, so the same one is never built twice
+        self.build_lock = threading.Lock()
+
+        self.jobs = queue.PriorityQueue()
+        self.job_order = itertools.count()
+        self.worker = threading.Thread(target=self.work)
+        self.worker.daemon = True
+        self.worker.start()
+
+        if not self.compiled and pack is None:
+            self.add_job(self.SAVE_CACHE)
+
+    def __len__(self):
+        if self.pack is not None:
+            return len(self.pack)
+        return len(levels.level_generators)
+
+    def __getitem__(self, level_num):
+        if not 0 <= level_num < len(self):
+            raise IndexError("there is no level %i" % level_num)
+
+        level = self.kept_level(level_num)
+        if level:
+            return level
+
+        with self.build_lock:
+            # The worker might have built it while this was waiting
+            level = self.kept_level(level_num)
+            if level:
+                return level
+
+            if self.pack is not None:
+                level = self.pack.level(level_num)
+            elif self.compiled:
+                level = self.compiled.level(level_num)
+            else:
+                level = levels.level_generators[level_num]()
+
+        with self.lock:
+            self.levels[level_num] = level
+            while len(self.levels) > self.max_levels:
+                self.levels.popitem(last=False)
+
+        return level
+
+    def kept_level(self, level_num):
+        """Returns the level if it is being kept, marking it as the most
+        recently used, or None if it isn't.
+        """
+        with self.lock:
+            if level_num not in self.levels:
+                return None
+
+            self.levels.move_to_end(level_num)
+            return self.levels[level_num]
+
+    def prefetch(self, level_nums):
+        """Builds each level in level_nums in the background, if it exists
+        and isn't already kept.
+        """
+        for level_num in level_nums:
+            if 0 <= level_num < len(self):
+                self.add_job(self.PREFETCH, level_num)
+
+    def add_job(self, kind, level_num=None):
+        self.jobs.put((kind, next(self.job_order), level_num))
+
+    def work(self):
+        while True:
+            kind, order, level_num = self.jobs.get()
+            if kind == self.PREFETCH:
+                self[level_num]
+            elif kind == self.SAVE_CACHE:
+                try:
+                    level_cache.save_all(self.path)
+                except OSError:
+                    # Not being able to save only makes the next start slower
+                    continue
+                self.compiled = level_cache.open_cache(self.path)
@@ -1,12 +1,9 @@
-import pygame
 import math
 
 import utility
 import geometry
 import constants
 
-pygame.init()
-
 
 BLACK = constants.BLACK
 WHITE = constants.WHITE
@@ -31,17 +28,71 @@ PALE_ORANGE = constants.PALE_ORANGE
 class Level:
     WALL_DISTANCE = 6
 
-    def __init__(self, collision, goals, start_position, start_orientation):
+    def __init__(self, collision, goals, start_position, start_orientation, goal_raster=None):
         self.start_position = start_position
         self.start_orientation = start_orientation
 
         # Viewable lines.  Does not correspond to what the player actual hits.
         self.collision = collision
 
+        # Actual collision, which is only built if the player needs it.
+        # See build_player_collision()
+        self.player_collision = None
+        self.player_collision_table = None
+        self.player_collision_grid = None
+
+        # Viewable lines.  These are sorted by color so that, when they are
+        # drawn, the way they overlap at corners is consistent
+        segment_list = []
+        for polygon in collision:
+            for segment in polygon.segments:
+                segment_list.append(segment)
+        self.segment_list = sorted(segment_list, key=geometry.segment_priority)
+
+        # The same lines in their original order, plus a flat, array-backed
+        # copy of them for the code that handles many segments at once
+        self.collision_segments = tuple(segment_list)
+        self.collision_table = geometry.segment_table(segment_list)
+
+        # Lets ray queries and circle collision skip the lines that are
+        # nowhere near them
+        self.collision_grid = geometry.SegmentGrid(segment_list, self.collision_table)
+
+        # Every ray cast against the viewable lines goes through here
+        self.rays = geometry.RayCaster(segment_list, self.collision_grid, self.collision_table)
+
+        self.goals = goals
+        self.goal_count = len(goals)
+
+        # Which goal each pixel is in, so that placing circles and checking
+        # for a win don't need a point_in_polygon() per goal.  goal_raster
+        # is the mask's raster from a compiled copy of the level, if any.
+        self.goal_mask = geometry.PolygonMask(goals, constants.SCREEN_WIDTH, constants.SCREEN_HEIGHT,
+                                              goal_raster)
+
+    def build_player_collision(self):
+        """Builds the collision used by player.OFFSET_COLLISION, if it
+        hasn't been built already.  player.CIRCLE_COLLISION collides with
+        the viewable lines directly, so it never needs this.
+        """
+        if self.player_collision_grid is not None:
+            return
+
+        # A compiled copy of the level comes with the segments already made
+        if self.player_collision is None:
+            self.player_collision = self.offset_collision()
+
+        # Lets movement skip the collision that is nowhere near the player
+        self.player_collision_table = geometry.segment_table(self.player_collision)
+        self.player_collision_grid = geometry.SegmentGrid(self.player_collision,
+                                                          self.player_collision_table)
+
+    def offset_collision(self):
+        """Returns the segments for player.OFFSET_COLLISION."""
         # Actual collision.  Extends outwards from the viewable lines
         # since getting too close to one is disorienting
-        self.player_collision = []
-        for polygon in collision:
+        player_collision = []
+        for polygon in self.collision:
             # One side is "inside" the polygon, the other is "outside".  Though
             # some polygons aren't closed, so there is no "inside" or "outside",
             # only two sides.
@@ -78,7 +129,7 @@ class Level:
                         point_list.append(point)
 
                 segment_list = geometry.points_to_segment_list(point_list)
-                self.player_collision.extend(segment_list)
+                player_collision.extend(segment_list)
 
                 # Side 2
                 point_list = []
@@ -91,7 +142,7 @@ class Level:
                         point_list.append(point)
 
                 segment_list = geometry.points_to_segment_list(point_list)
-                self.player_collision.extend(segment_list)
+                player_collision.extend(segment_list)
 
             else:
                 # Side 1
@@ -106,13 +157,13 @@ class Level:
                 point_list.append(segments_side_1[-1].point2)
 
                 segment_list = geometry.points_to_segment_list(point_list, False)
-                self.player_collision.extend(segment_list)
+                player_collision.extend(segment_list)
 
                 # Cap 1
                 point_1 = polygon.point_list[1]
                 point_2 = polygon.point_list[0]
                 cap = self.create_cap(point_1, point_2)
-                self.player_collision.extend(cap)
+                player_collision.extend(cap)
 
                 # Side 2
                 point_list = [segments_side_2[0].point1]
@@ -126,24 +177,25 @@ class Level:
                 point_list.append(segments_side_2[-1].point2)
 
                 segment_list = geometry.points_to_segment_list(point_list, False)
-                self.player_collision.extend(segment_list)
+                player_collision.extend(segment_list)
 
                 # Cap 2
                 point_1 = polygon.point_list[-2]
                 point_2 = polygon.point_list[-1]
                 cap = self.create_cap(point_1, point_2)
-                self.player_collision.extend(cap)
+                player_collision.extend(cap)
 
-        # Viewable lines.  These are sorted by color so that, when they are
-        # drawn, the way they overlap at corners is consistent
-        segment_list = []
-        for polygon in collision:
-            for segment in polygon.segments:
-                segment_list.append(segment)
-        self.segment_list = sorted(segment_list, key=geometry.segment_priority)
+        return player_collision
 
-        self.goals = goals
-        self.goal_count = len(goals)
+    def goals_filled(self, goal_lists):
+        """Returns True if every goal appears in goal_lists, which holds
+        the goal_mask.all_indices_at() of each placed circle.
+        """
+        filled_goals = set()
+        for goal_list in goal_lists:
+            filled_goals.update(goal_list)
+
+        return len(filled_goals) == self.goal_count
 
     def draw_debug_goals(self, surface, offset=(0, 0), alpha=255):
         for polygon in self.goals:
@@ -1232,6 +1284,40 @@ def generate_shapes_level():
     return level
 
 
+# Every level, in the order they are played
+level_generators = (generate_three_boxes_level,
+                    generate_triangle_level,
+                    generate_jesters_hat_level,
+                    generate_plus_level,
+                    generate_single_line_level,
+                    generate_pentagon_level,
+                    generate_two_lines_level,
+                    generate_tunnel_level,
+                    generate_wings_level,
+                    generate_buckets_level,
+                    generate_reticles_level,
+                    generate_shapes_level,
+                    generate_missing_corner_level,
+                    generate_z_level,
+                    generate_increasing_level,
+                    generate_pegs_level,
+                    generate_staircase_level,
+                    generate_hexagon_level,
+                    generate_alignment_level,
+                    generate_triangle_array_level,
+                    generate_spiral_level,
+                    generate_flag_level,
+                    generate_nerfed_keyhole_level,
+                    generate_boxception_level,
+                    generate_nerfed_diamond_level,
+                    generate_grid_level,
+                    generate_nerfed_h_level,
+                    generate_cube_level,
+                    generate_star_level,
+                    generate_heart_level
+                    )
+
+
 # Level template
 # def generate_<name>_level():
 #     collision_1 = geometry.Polygon(((x, y), (x, y), (x, y)))
@@ -1,16 +1,28 @@
-import pygame
 import math
 
 import utility
 import geometry
-import events
 import constants
 
-pygame.init()
+try:
+    import pygame
+    import events
+except ImportError:
+    # Without pygame there is no keyboard or mouse, so the player can only
+    # be moved with walk()
+    pygame = None
 
 FOV = math.pi / 2
 sensitivity = 0.002
 
+# How the player collides with walls.  OFFSET_COLLISION checks the player's
+# path against copies of the walls pushed out by Level.WALL_DISTANCE.
+# CIRCLE_COLLISION treats the player as a circle with that radius, and
+# slides it along the walls themselves.
+OFFSET_COLLISION = 0
+CIRCLE_COLLISION = 1
+collision_mode = OFFSET_COLLISION
+
 
 class Player:
     MOVEMENT_SPEED = 1.3
@@ -22,14 +34,20 @@ class Player:
         self.angle = 0.0
 
     def update_movement(self, level):
-        self.angle += (float(events.mouse.relative[0]) * sensitivity)
+        """Turns and moves the player using the mouse and keyboard."""
+        self.walk(level, float(events.mouse.relative[0]) * sensitivity,
+                  pygame.K_w in events.keys.queue, pygame.K_a in events.keys.queue,
+                  pygame.K_s in events.keys.queue, pygame.K_d in events.keys.queue)
+
+    def walk(self, level, turn, key_w_pressed, key_a_pressed, key_s_pressed, key_d_pressed):
+        """Turns the player by turn radians, then moves them one frame's
+        worth in the direction given by which of the movement keys are held.
+        Doesn't need pygame, so it can be used to move the player without
+        a keyboard.
+        """
+        self.angle += turn
         self.angle = geometry.mod_angle(self.angle)
 
-        key_a_pressed = pygame.K_a in events.keys.queue
-        key_w_pressed = pygame.K_w in events.keys.queue
-        key_d_pressed = pygame.K_d in events.keys.queue
-        key_s_pressed = pygame.K_s in events.keys.queue
-
         key_a = key_a_pressed and not key_d_pressed
         key_d = key_d_pressed and not key_a_pressed
         key_w = key_w_pressed and not key_s_pressed
@@ -60,12 +78,18 @@ class Player:
         angle = geometry.mod_angle(angle)
         difference = geometry.vector_to_difference(angle, self.MOVEMENT_SPEED)
 
+        if collision_mode == CIRCLE_COLLISION:
+            self.go_to(geometry.slide_circle(self.position, difference,
+                                             level.WALL_DISTANCE, level.collision_grid))
+            return
+
+        level.build_player_collision()
         next_position = utility.add_tuples(difference, self.position)
 
         collide = False
 
         move_segment = geometry.Segment(self.position, next_position)
-        for segment in level.player_collision:
+        for segment in level.player_collision_grid.segments_near(move_segment):
             if geometry.segments_collide(segment, move_segment):
                 collide = True
 
@@ -118,19 +142,33 @@ class Player:
         self.y = float(self.position[1])
 
     def draw_debug(self, surface, level, offset=(0, 0)):
+        """Draws the player and the edges of their view.  Returns the
+        rectangles that were drawn on.
+        """
         position = utility.int_tuple(self.position)
 
         if offset != (0, 0):
             position = utility.add_tuples(position, offset)
 
-        self.draw_visor_line(surface, self.angle - FOV / 2, level, offset)
-        self.draw_visor_line(surface, self.angle + FOV / 2, level, offset)
-
-        pygame.draw.circle(surface, constants.BLACK, position, 7)
-
-    def draw_visor_line(self, surface, angle, level, offset=(0, 0)):
+        # Both edges of the field of view are cast together
+        angles = (self.angle - FOV / 2, self.angle + FOV / 2)
+        rects = []
+        for angle, hit in zip(angles, level.rays.cast_all(self.position, angles)):
+            if hit:
+                rects.append(self.draw_visor_line(surface, angle, hit.point, offset))
+            else:
+                rects.append(self.draw_visor_line(surface, angle, None, offset))
+
+        rects.append(pygame.draw.circle(surface, constants.BLACK, position, 7))
+        return rects
+
+    def draw_visor_line(self, surface, angle, point2, offset=(0, 0)):
+        """Draws a line from the player to point2, which is where the
+        edge of the player's view hits a wall.  If point2 is None, the line
+        goes to the edge of the screen instead.  Returns the rectangle that
+        was drawn on, or None if nothing was drawn.
+        """
         point1 = self.position
-        point2 = geometry.closest_wall_level_intersection(self.position, level, angle)
 
         if point2:
             if offset != (0, 0):
@@ -139,7 +177,7 @@ class Player:
 
             # Experimented with line thickness 2, reduces game-feel but
             # increases visibility of lines
-            pygame.draw.line(surface, constants.BLACK, point1, point2, 2)
+            return pygame.draw.line(surface, constants.BLACK, point1, point2, 2)
         else:
             point2 = geometry.screen_edge(self.position, angle, offset)
             if point2:
@@ -147,11 +185,13 @@ class Player:
                     point1 = utility.add_tuples(point1, offset)
 
                 # Line thickness 2 here as well
-                pygame.draw.line(surface, constants.BLACK, point1, point2, 2)
+                return pygame.draw.line(surface, constants.BLACK, point1, point2, 2)
+
+        return None
 
     def movement_collides_level(self, position, level):
         move_segment = geometry.Segment(self.position, position)
-        for segment in level.player_collision:
+        for segment in level.player_collision_grid.segments_near(move_segment):
             if geometry.segments_collide(segment, move_segment):
                 return True
         return False
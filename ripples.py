@@ -1,66 +1,149 @@
 import pygame
+import collections
 import math
 
-import constants
+import numpy
 
-pygame.init()
-pygame.display.set_mode(constants.SCREEN_SIZE)
 
+# Rings that have been drawn, from (radius, color, alpha) to surface, with
+# the most recently used last.  Every ripple of the same size and duration
+# goes through the same radii and alphas, so there are only a few of them.
+ring_sprites = collections.OrderedDict()
+MAX_RING_SPRITES = 1024
+ALPHA_STEP = 5
 
-class Ripple:
-    def __init__(self, position, color, final_radius=20, duration=30):
-        self.frame = 0
-        self.last_frame = duration
 
-        self.position = (int(position[0]), int(position[1]))
-        self.radius = 1.0
-        self.final_radius = final_radius
-        self.alpha = 0
+def ring_sprite(radius, color, alpha):
+    """Returns a surface with a one pixel wide ring drawn on it, centered at
+    (radius + 1, radius + 1).  alpha is rounded to a multiple of ALPHA_STEP.
+    """
+    alpha = min(max(int(round(alpha / ALPHA_STEP)) * ALPHA_STEP, 0), 255)
+    key = (radius, tuple(color), alpha)
 
-        self.expand_a = abs(final_radius - 1.0)
-        self.expand_k = math.pi / (2 * duration)
-        self.color = color
+    if key in ring_sprites:
+        ring_sprites.move_to_end(key)
+        return ring_sprites[key]
 
-    def update(self):
-        self.radius = math.sin(self.expand_k * self.frame)
-        self.radius = self.expand_a * self.radius + 1.0
+    size = radius * 2 + 2
+    sprite = pygame.Surface((size, size)).convert_alpha()
+    sprite.fill((0, 0, 0, 0))
+    ring_color = (color[0], color[1], color[2], alpha)
+    pygame.draw.circle(sprite, ring_color, (radius + 1, radius + 1), radius, 1)
 
-        self.alpha = 255 - int((self.frame / self.last_frame) * 255)
+    ring_sprites[key] = sprite
+    if len(ring_sprites) > MAX_RING_SPRITES:
+        ring_sprites.popitem(last=False)
 
-        self.frame += 1
+    return sprite
 
-    def draw(self, surface, offset=(0, 0)):
-        position = (self.position[0] + offset[0], self.position[1] + offset[1])
 
-        color = (self.color[0], self.color[1], self.color[2], self.alpha)
-        radius = int(self.radius)
-        pygame.draw.circle(surface, color, position, radius, 1)
+class RippleHandler:
+    """Every ripple drawn on one surface.
 
+    The ripples are kept as a structure of arrays, with ripple i in row i
+    of each array, so that they can all be updated at once.  Only the first
+    count rows are in use, and the arrays double in size when they fill up.
 
-temp_surface = pygame.Surface(constants.SCREEN_SIZE).convert_alpha()
+    A ripple grows from a radius of 1 to its final radius, easing out, while
+    fading from opaque to transparent over its duration in frames.
+    """
+    START_CAPACITY = 16
 
+    # Every array that has a row per ripple
+    ARRAYS = ("positions", "colors", "frames", "durations", "final_radii", "radii", "alphas")
 
-class RippleHandler:
     def __init__(self):
-        self.ripples = []
+        self.count = 0
 
-    def update(self):
-        ripple_num = len(self.ripples)
-        for ripple in reversed(self.ripples):
-            ripple_num -= 1
-            ripple.update()
+        capacity = self.START_CAPACITY
+        self.positions = numpy.zeros((capacity, 2), dtype=int)
+        self.colors = numpy.zeros((capacity, 3), dtype=int)
+        self.frames = numpy.zeros(capacity, dtype=int)
+        self.durations = numpy.ones(capacity, dtype=int)
+        self.final_radii = numpy.zeros(capacity)
+
+        # What is drawn, as of the last update()
+        self.radii = numpy.ones(capacity)
+        self.alphas = numpy.zeros(capacity, dtype=int)
 
-            if ripple.frame == ripple.last_frame:
-                del self.ripples[ripple_num]
+    def __len__(self):
+        return self.count
+
+    def update(self):
+        """Moves every ripple on by a frame, and removes the ones that have
+        finished.
+        """
+        if not self.count:
+            return
+
+        count = self.count
+        frames = self.frames[:count]
+        durations = self.durations[:count]
+
+        expand_a = numpy.abs(self.final_radii[:count] - 1.0)
+        expand_k = math.pi / (2 * durations)
+        self.radii[:count] = expand_a * numpy.sin(expand_k * frames) + 1.0
+        self.alphas[:count] = 255 - (frames / durations * 255).astype(int)
+
+        frames += 1
+
+        finished = frames == durations
+        if finished.any():
+            self.keep(~finished)
+
+    def keep(self, kept):
+        """Removes every ripple that isn't in the boolean array kept, moving
+        the rest down so they stay in order.
+        """
+        kept_count = int(numpy.count_nonzero(kept))
+        for name in self.ARRAYS:
+            array = getattr(self, name)
+            array[:kept_count] = array[:self.count][kept]
+        self.count = kept_count
 
     def draw(self, surface, offset=(0, 0)):
-        temp_surface.fill((0, 0, 0, 0))
-        for ripple in self.ripples:
-            ripple.draw(temp_surface)
-        surface.blit(temp_surface, offset)
+        """Draws every ripple.  Returns the rectangle around all of them,
+        or None if there aren't any.
+        """
+        if not self.count:
+            return None
+
+        count = self.count
+        radii = self.radii[:count].astype(int)
+
+        # The ring's center is at (radius + 1, radius + 1) in its sprite
+        corners = self.positions[:count] + offset - radii[:, None] - 1
+        sprites = [ring_sprite(radius, color, alpha) for radius, color, alpha
+                   in zip(radii.tolist(), self.colors[:count].tolist(), self.alphas[:count].tolist())]
+        surface.blits(zip(sprites, corners.tolist()), False)
+
+        sizes = radii * 2 + 2
+        left, top = corners.min(axis=0).tolist()
+        right = int((corners[:, 0] + sizes).max())
+        bottom = int((corners[:, 1] + sizes).max())
+        return pygame.Rect(left, top, right - left, bottom - top).clip(surface.get_rect())
 
     def create_ripple(self, position, color, final_radius=20, duration=30):
-        self.ripples.append(Ripple(position, color, final_radius, duration))
+        if self.count == len(self.frames):
+            self.grow()
+
+        index = self.count
+        self.positions[index] = (int(position[0]), int(position[1]))
+        self.colors[index] = color[:3]
+        self.frames[index] = 0
+        self.durations[index] = duration
+        self.final_radii[index] = final_radius
+        self.radii[index] = 1.0
+        self.alphas[index] = 0
+        self.count += 1
+
+    def grow(self):
+        """Doubles the number of ripples there is room for."""
+        for name in self.ARRAYS:
+            array = getattr(self, name)
+            bigger = numpy.zeros((len(array) * 2,) + array.shape[1:], dtype=array.dtype)
+            bigger[:len(array)] = array
+            setattr(self, name, bigger)
 
     def clear(self):
-        self.ripples.clear()
+        self.count = 0
@@ -0,0 +1,70 @@
+"""The game's rules without a window, sound or keyboard, for playing levels
+in scripts many times faster than real time.
+
+Nothing here needs pygame.  A Simulation stands in for one attempt at a
+level: step() is one frame of the player turning and walking, and
+place_signal() and won() follow the same rules as the real game.
+"""
+import geometry
+import levels
+import level_cache
+import player
+
+
+def load_level(level_num):
+    """Returns level level_num, read from the level cache if it is up to
+    date, or built from its generator otherwise.
+    """
+    compiled = level_cache.open_cache()
+    if compiled:
+        return compiled.level(level_num)
+    return levels.level_generators[level_num]()
+
+
+class Simulation:
+    def __init__(self, level):
+        self.level = level
+
+        self.player = player.Player()
+        self.player.go_to(level.start_position)
+        self.player.angle = level.start_orientation
+
+        self.visibility = geometry.IncrementalVisibility(level)
+
+        # A (position, goal indices) pair for each placed circle
+        self.signals = []
+        self.frame = 0
+
+    def step(self, turn=0.0, forward=False, left=False, backward=False, right=False):
+        """Runs one frame of the player turning by turn radians and walking
+        with the given movement keys held.
+        """
+        self.player.walk(self.level, turn, forward, left, backward, right)
+        self.frame += 1
+
+    def visible_spans(self):
+        """Returns what the player can see, in the same format as
+        geometry.visible_spans().
+        """
+        return self.visibility.spans(self.player.position)
+
+    def place_signal(self, position=None):
+        """Places a circle at position, or where the player is standing if
+        position is None.  Returns False without placing it if every circle
+        has already been placed.
+        """
+        if len(self.signals) >= self.level.goal_count:
+            return False
+
+        if position is None:
+            position = self.player.position
+        self.signals.append((position, self.level.goal_mask.all_indices_at(position)))
+        return True
+
+    def won(self):
+        """Returns True if every circle has been placed and every goal has
+        one in it.
+        """
+        if len(self.signals) < self.level.goal_count:
+            return False
+        return self.level.goals_filled(goals for position, goals in self.signals)
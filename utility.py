@@ -1,6 +1,13 @@
-import pygame
+import collections
+
 import constants
 
+try:
+    import pygame
+except ImportError:
+    # Only needed for drawing text, so the game's logic can run without it
+    pygame = None
+
 
 def int_tuple(tuple_):
     return int(tuple_[0]), int(tuple_[1])
@@ -21,6 +28,10 @@ def average(*args):
     return total / len(args)
 
 
+def average_points(point1, point2):
+    return (point1[0] + point2[0]) / 2, (point1[1] + point2[1]) / 2
+
+
 def binary_search_by_first_item(list_of_lists, value):
     """Returns the first list whose first item is greater than the angle.
 
@@ -44,10 +55,35 @@ def blit_vert_center(destination, surface, y):
     destination.blit(surface, (x, y))
 
 
+# Faded text surfaces, from (font, string, alpha) to surface, with the most
+# recently used last
+text_cache = collections.OrderedDict()
+TEXT_CACHE_SIZE = 512
+TEXT_ALPHA_STEP = 5
+
+
 def black_text_alpha(font, string, alpha):
+    """Returns string rendered in black at the given alpha value.
+
+    The same few strings are drawn every frame, so the surfaces are kept
+    and reused.  alpha is rounded to a multiple of TEXT_ALPHA_STEP so that
+    fades reuse them too.  Don't draw on the surface that is returned.
+    """
+    alpha = min(max(int(round(alpha / TEXT_ALPHA_STEP)) * TEXT_ALPHA_STEP, 0), 255)
+    key = (font, string, alpha)
+
+    if key in text_cache:
+        text_cache.move_to_end(key)
+        return text_cache[key]
+
     text_surface = font.render(string, True, constants.BLACK)
+    text_surface = black_image_alpha(text_surface, alpha)
+
+    text_cache[key] = text_surface
+    if len(text_cache) > TEXT_CACHE_SIZE:
+        text_cache.popitem(last=False)
 
-    return black_image_alpha(text_surface, alpha)
+    return text_surface
 
 
 def black_image_alpha(surface, alpha):
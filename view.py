@@ -0,0 +1,173 @@
+import pygame
+import math
+
+import constants
+import geometry
+import player
+
+FOV = player.FOV
+PIXEL_ANGLE = FOV / constants.SCREEN_WIDTH
+HEIGHT = 20
+
+
+def draw_spans(surface, y, spans, lowest_angle):
+    """Draws the part of a list of visible_spans() that is inside the
+    view, which starts at lowest_angle and is FOV wide.
+    """
+    for start_angle, end_angle, color in spans:
+        if color == constants.WHITE:
+            continue
+
+        # Angles relative to the left edge of the view.  The span might
+        # wrap around past a full turn, so it is also checked one turn back.
+        start = (start_angle - lowest_angle) % (math.pi * 2)
+        end = start + (end_angle - start_angle)
+        for turn in (0.0, math.pi * 2):
+            left = max(start - turn, 0.0)
+            right = min(end - turn, FOV)
+            if left < right:
+                left_x = int(left / PIXEL_ANGLE)
+                if right == FOV:
+                    right_x = constants.SCREEN_WIDTH
+                else:
+                    right_x = int(right / PIXEL_ANGLE)
+                surface.fill(color, (left_x, y, right_x - left_x, HEIGHT))
+
+
+class Panorama:
+    """Remembers everything the player can see from where they are.
+
+    What is visible only depends on the player's position.  The angle just
+    picks which part of the full circle is on screen.  So while the player
+    stands still and looks around, the spans are reused, and after one
+    frame they are drawn into a strip covering the whole circle.  Drawing
+    the view is then a single blit out of that strip.
+    """
+    # One full turn, plus one extra screen width copied from the start, so
+    # that any view can be blitted without wrapping around
+    TURN_WIDTH = int(round(math.pi * 2 / PIXEL_ANGLE))
+    STRIP_WIDTH = TURN_WIDTH + constants.SCREEN_WIDTH
+
+    def __init__(self):
+        self.level = None
+        self.visibility = None
+        self.position = None
+        self.spans = []
+
+        # A visibility_field.LevelField for the current level, if one was
+        # built.  Anywhere it doesn't cover falls back to the exact sweep.
+        self.field = None
+
+        self.strip = pygame.Surface((self.STRIP_WIDTH, HEIGHT))
+        self.strip.set_colorkey(constants.WHITE)
+        self.strip_ready = False
+        self.still_frames = 0
+
+    def update(self, level, position):
+        """Returns the visible_spans() for position, only recomputing them
+        if the player moved or the level changed.  Small moves update last
+        frame's spans rather than starting over.
+        """
+        if level is not self.level:
+            self.level = level
+            self.visibility = geometry.IncrementalVisibility(level)
+            self.position = None
+
+        if position == self.position:
+            self.still_frames += 1
+        else:
+            self.position = position
+            self.spans = None
+            if self.field:
+                self.spans = self.field.spans(position)
+            if self.spans is None:
+                self.spans = self.visibility.spans(position)
+            self.strip_ready = False
+            self.still_frames = 0
+
+        return self.spans
+
+    def reset(self, field=None):
+        """Forgets everything, for when the player teleports.  field is the
+        precomputed visibility for the level being teleported to, if any.
+        """
+        self.level = None
+        self.field = field
+
+    def draw(self, surface, y, lowest_angle):
+        """Draws the view starting at lowest_angle.  Uses the strip once the
+        player has stood still for a frame, since building it costs more
+        than drawing the spans directly.
+        """
+        if not self.still_frames:
+            draw_spans(surface, y, self.spans, lowest_angle)
+            return
+
+        if not self.strip_ready:
+            self.draw_strip()
+
+        x = int(((lowest_angle + math.pi) % (math.pi * 2)) / PIXEL_ANGLE)
+        x = min(x, self.TURN_WIDTH)
+        surface.blit(self.strip, (0, y), (x, 0, constants.SCREEN_WIDTH, HEIGHT))
+
+    def draw_strip(self):
+        """Draws every span into the strip, with -pi at the left edge.  The
+        strip is drawn one screen width at a time.
+        """
+        self.strip.fill(constants.WHITE)
+
+        width = constants.SCREEN_WIDTH
+        for index in range(int(math.ceil(self.STRIP_WIDTH / width))):
+            section = self.strip.subsurface((index * width, 0, width, HEIGHT))
+            draw_spans(section, 0, self.spans, -math.pi + FOV * index)
+
+        self.strip_ready = True
+
+
+class LevelLayer:
+    """The goals and outline of a level, drawn once and then blitted every
+    frame, since they don't change while the level is played.
+
+    They are drawn again when the level, the goal colors or the goals'
+    alpha change.  Alpha is rounded to a multiple of ALPHA_STEP so that a
+    fade only draws them a few dozen times.
+    """
+    ALPHA_STEP = 5
+
+    def __init__(self):
+        self.key = None
+        self.surface = None
+
+    def update(self, level, offset, goal_alpha=None):
+        """Makes the layer show the level's outline, and its goals too
+        unless goal_alpha is None.  Returns True if the layer had to be
+        drawn again.
+        """
+        if goal_alpha is not None:
+            goal_alpha = min(max(int(round(goal_alpha / self.ALPHA_STEP)) * self.ALPHA_STEP, 0), 255)
+
+        key = (level, tuple(goal.color for goal in level.goals), goal_alpha, offset)
+        if key == self.key:
+            return False
+
+        self.key = key
+        self.draw_layer(level, offset, goal_alpha)
+        return True
+
+    def draw(self, surface):
+        """Draws the layer.  Whatever is under it should be white."""
+        surface.blit(self.surface, (0, 0))
+
+    def draw_layer(self, level, offset, goal_alpha):
+        if not self.surface:
+            self.surface = pygame.Surface(constants.SCREEN_SIZE).convert()
+            self.surface.set_colorkey(constants.WHITE, pygame.RLEACCEL)
+
+        self.surface.fill(constants.WHITE)
+        if goal_alpha is not None:
+            level.draw_debug_goals(self.surface, offset, goal_alpha)
+        level.draw_debug_outline(self.surface, offset)
+
+    def reset(self):
+        """Forgets the layer, so it is drawn again next frame."""
+        self.key = None
@@ -0,0 +1,343 @@
+"""Precomputed sightlines for every level, for machines too slow to work
+them out every frame.
+
+Levels never change, so what the player sees from any spot can be worked
+out ahead of time.  Each level is split into square cells, and the spans
+seen from the middle of every cell the player can reach are saved into
+one file.  The game memory-maps that file and looks up the nearest cell
+instead of sweeping, and falls back to the exact sweep anywhere the file
+has nothing: within EXACT_DISTANCE of a wall, where moving a little
+changes the view the most, anywhere the player can't walk to from the
+start, and in levels that have changed since the file was built.
+
+To build the file:     python visibility_field.py [cell size]
+To check it is right:  python visibility_field.py validate
+"""
+import collections
+import mmap
+import math
+import os
+import random
+import struct
+import sys
+import hashlib
+import multiprocessing
+
+import numpy
+
+import constants
+import geometry
+import levels
+
+FIELD_PATH = "visibility_field.bin"
+MAGIC = b"SLVF"
+VERSION = 2
+CELL_SIZE = 4
+
+# Cells with any part closer than this to a wall are left empty, so the
+# exact sweep is used there
+EXACT_DISTANCE = 16
+
+# Cells this size or smaller can't have a wall slip between two of them
+# that are both at least WALL_DISTANCE from every wall
+REACH_CELL_SIZE = 4
+
+# magic, version, level count, cell size
+HEADER = struct.Struct("<4sIII")
+# level signature, columns, rows, offsets position, records position,
+# palette position, palette size
+ENTRY = struct.Struct("<20sIIQQQI")
+
+# Each span is stored as the angle it starts at, scaled so that a whole
+# turn is ANGLE_STEPS, and an index into the level's palette.  A span ends
+# where the next one starts, and the first one always starts at -pi.
+RECORD = numpy.dtype([("angle", "<u2"), ("color", "u1")])
+ANGLE_STEPS = 65536
+
+
+def level_signature(level):
+    """Returns a hash of everything about a level that affects what the
+    player sees, so that out of date fields can be spotted.
+    """
+    walls = tuple((tuple(map(float, segment.point1)), tuple(map(float, segment.point2)), segment.color)
+                  for segment in level.collision_segments)
+    return hashlib.sha1(repr(walls).encode()).digest()
+
+
+def wall_distances(points, table):
+    """Returns the distance from each point (an N by 2 array) to the
+    closest segment in table.
+    """
+    if not len(table):
+        return numpy.full(len(points), numpy.inf)
+
+    to_start_x = points[:, 0, numpy.newaxis] - table.x1
+    to_start_y = points[:, 1, numpy.newaxis] - table.y1
+    u = (to_start_x * table.delta_x + to_start_y * table.delta_y) / (table.length ** 2)
+    u = numpy.clip(u, 0.0, 1.0)
+    distances = numpy.hypot(to_start_x - u * table.delta_x, to_start_y - u * table.delta_y)
+    return distances.min(axis=1)
+
+
+def cell_centers(cell_size):
+    """Returns the middle of every cell_size wide cell on the screen, row
+    by row, as an N by 2 array, along with the number of columns and rows.
+    """
+    columns = constants.SCREEN_WIDTH // cell_size
+    rows = constants.SCREEN_HEIGHT // cell_size
+    centers = numpy.empty((columns * rows, 2))
+    centers[:, 0] = numpy.tile(numpy.arange(columns) * cell_size + cell_size / 2, rows)
+    centers[:, 1] = numpy.repeat(numpy.arange(rows) * cell_size + cell_size / 2, columns)
+    return centers, columns, rows
+
+
+def reachable_cells(level):
+    """Returns a rows by columns array of REACH_CELL_SIZE wide cells, True
+    for each one the player can walk to from the level's start.
+
+    A cell is open if its middle is at least WALL_DISTANCE from every wall,
+    like the player.  Open cells next to each other are close enough that
+    no wall can pass between them, so flooding out from the cells around
+    the start finds everywhere the player can reach.
+    """
+    centers, columns, rows = cell_centers(REACH_CELL_SIZE)
+    distances = wall_distances(centers, level.collision_table)
+    open_cells = (distances >= levels.Level.WALL_DISTANCE).reshape(rows, columns)
+
+    start_column = int(level.start_position[0] // REACH_CELL_SIZE)
+    start_row = int(level.start_position[1] // REACH_CELL_SIZE)
+    reachable = numpy.zeros((rows, columns), dtype=bool)
+    queue = collections.deque()
+    for row in range(max(start_row - 1, 0), min(start_row + 2, rows)):
+        for column in range(max(start_column - 1, 0), min(start_column + 2, columns)):
+            if open_cells[row, column]:
+                reachable[row, column] = True
+                queue.append((column, row))
+
+    while queue:
+        column, row = queue.popleft()
+        for neighbour_column, neighbour_row in ((column + 1, row), (column - 1, row),
+                                                (column, row + 1), (column, row - 1)):
+            if (0 <= neighbour_column < columns and 0 <= neighbour_row < rows
+                    and open_cells[neighbour_row, neighbour_column]
+                    and not reachable[neighbour_row, neighbour_column]):
+                reachable[neighbour_row, neighbour_column] = True
+                queue.append((neighbour_column, neighbour_row))
+
+    return reachable
+
+
+def build_level(arguments):
+    """Works out the field for one level.  Runs in a worker process, so it
+    takes a single (level number, cell size) pair and generates the level
+    itself.
+    """
+    level_num, cell_size = arguments
+    level = levels.level_generators[level_num]()
+
+    centers, columns, rows = cell_centers(cell_size)
+
+    # The player can stand anywhere in a cell, up to half a diagonal away
+    # from its middle
+    covered = wall_distances(centers, level.collision_table)
+    covered = covered >= EXACT_DISTANCE + cell_size / math.sqrt(2)
+
+    # Only cells whose middle the player can walk to are needed
+    reachable = reachable_cells(level)
+    reach_columns = (centers[:, 0] // REACH_CELL_SIZE).astype(int)
+    reach_rows = (centers[:, 1] // REACH_CELL_SIZE).astype(int)
+    covered &= reachable[reach_rows, reach_columns]
+
+    palette = []
+    offsets = numpy.zeros(columns * rows + 1, numpy.uint32)
+    records = []
+    for cell, center in enumerate(centers):
+        if covered[cell]:
+            for start_angle, end_angle, color in geometry.visible_spans(tuple(center), level):
+                if color not in palette:
+                    palette.append(color)
+
+                angle = int(round((start_angle + math.pi) / (math.pi * 2) * ANGLE_STEPS))
+                records.append((min(angle, ANGLE_STEPS - 1), palette.index(color)))
+
+        offsets[cell + 1] = len(records)
+
+    records = numpy.array(records, RECORD)
+    return level_signature(level), columns, rows, offsets, records, palette
+
+
+def build(path=FIELD_PATH, cell_size=CELL_SIZE):
+    """Builds the field for every level, one level per process, and saves
+    it to path.
+    """
+    jobs = [(level_num, cell_size) for level_num in range(len(levels.level_generators))]
+    pool = multiprocessing.Pool()
+    try:
+        results = pool.map(build_level, jobs)
+    finally:
+        pool.close()
+        pool.join()
+
+    with open(path, "wb") as file:
+        file.write(HEADER.pack(MAGIC, VERSION, len(results), cell_size))
+        entries_position = file.tell()
+        file.write(bytes(ENTRY.size * len(results)))
+
+        entries = []
+        for signature, columns, rows, offsets, records, palette in results:
+            positions = []
+            palette_bytes = bytes(channel for color in palette for channel in color)
+            for data in (offsets.tobytes(), records.tobytes(), palette_bytes):
+                # Keeps every array aligned, so they can be read in place
+                file.write(bytes(-file.tell() % 8))
+                positions.append(file.tell())
+                file.write(data)
+
+            entries.append(ENTRY.pack(signature, columns, rows,
+                                      positions[0], positions[1], positions[2], len(palette)))
+
+        file.seek(entries_position)
+        file.write(b"".join(entries))
+
+
+class LevelField:
+    """The part of a VisibilityField for a single level."""
+    def __init__(self, cell_size, columns, rows, offsets, records, palette):
+        self.cell_size = cell_size
+        self.columns = columns
+        self.rows = rows
+        self.offsets = offsets
+        self.records = records
+        self.palette = palette
+
+    def spans(self, position):
+        """Returns the spans seen from the middle of the cell closest to
+        position, in the same format as geometry.visible_spans(), or None
+        if the field doesn't cover that position, which is always the case
+        within EXACT_DISTANCE of a wall.
+        """
+        column = int(position[0] // self.cell_size)
+        row = int(position[1] // self.cell_size)
+        if not (0 <= column < self.columns and 0 <= row < self.rows):
+            return None
+
+        cell = row * self.columns + column
+        start = self.offsets[cell]
+        end = self.offsets[cell + 1]
+        if start == end:
+            return None
+
+        records = self.records[start:end]
+        angles = (records["angle"] / ANGLE_STEPS * math.pi * 2 - math.pi).tolist()
+        angles.append(math.pi)
+
+        spans = []
+        for index, color_index in enumerate(records["color"].tolist()):
+            geometry.add_span(spans, angles[index], angles[index + 1], self.palette[color_index])
+
+        return spans
+
+
+class VisibilityField:
+    """A field file, memory-mapped so that only the cells that are actually
+    looked at get read from disk.
+    """
+    def __init__(self, path=FIELD_PATH):
+        self.file = open(path, "rb")
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, level_count, self.cell_size = HEADER.unpack_from(self.map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError("%s is not a version %i visibility field" % (path, VERSION))
+
+        self.entries = [ENTRY.unpack_from(self.map, HEADER.size + index * ENTRY.size)
+                        for index in range(level_count)]
+
+    def level_field(self, level_num, level):
+        """Returns the LevelField for level, which is level number level_num,
+        or None if there isn't one or it is out of date.
+        """
+        if level_num >= len(self.entries):
+            return None
+
+        (signature, columns, rows, offsets_position, records_position,
+         palette_position, palette_size) = self.entries[level_num]
+        if signature != level_signature(level):
+            return None
+
+        offsets = numpy.frombuffer(self.map, numpy.uint32, columns * rows + 1, offsets_position)
+        records = numpy.frombuffer(self.map, RECORD, int(offsets[-1]), records_position)
+        palette_bytes = self.map[palette_position:palette_position + palette_size * 3]
+        palette = tuple(tuple(palette_bytes[index:index + 3])
+                        for index in range(0, len(palette_bytes), 3))
+
+        return LevelField(self.cell_size, columns, rows, offsets, records, palette)
+
+
+def load(path=FIELD_PATH):
+    """Returns the VisibilityField at path, or None if it hasn't been built
+    (or was built by a different version of the game).
+    """
+    if not os.path.exists(path):
+        return None
+
+    try:
+        return VisibilityField(path)
+    except (ValueError, struct.error):
+        return None
+
+
+def validate(path=FIELD_PATH, samples=200, seed=0):
+    """Compares the field against the exact sweep at random spots in the
+    cells it covers in every level, and prints how much of the circle they
+    agree on.
+    """
+    field = load(path)
+    if not field:
+        print("No visibility field at %s" % path)
+        return
+
+    rng = random.Random(seed)
+    check_angles = numpy.linspace(-math.pi, math.pi, 720, endpoint=False)
+    for level_num, generate in enumerate(levels.level_generators):
+        level = generate()
+        level_field = field.level_field(level_num, level)
+        if not level_field:
+            print("Level %i: missing or out of date" % level_num)
+            continue
+
+        stored_cells = numpy.flatnonzero(numpy.diff(level_field.offsets)).tolist()
+        if not stored_cells:
+            print("Level %i: no cells covered" % level_num)
+            continue
+
+        agreement = []
+        cell_size = level_field.cell_size
+        for _ in range(samples):
+            row, column = divmod(rng.choice(stored_cells), level_field.columns)
+            position = ((column + rng.random()) * cell_size, (row + rng.random()) * cell_size)
+            field_spans = level_field.spans(position)
+
+            exact_spans = geometry.visible_spans(position, level)
+            matches = numpy.mean([span_color_at(field_spans, angle) == span_color_at(exact_spans, angle)
+                                  for angle in check_angles])
+            agreement.append(matches)
+
+        print("Level %i: %.2f%% agreement" % (level_num, numpy.mean(agreement) * 100))
+
+
+def span_color_at(spans, angle):
+    for start_angle, end_angle, color in spans:
+        if start_angle <= angle < end_angle:
+            return color
+    return spans[-1][2]
+
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1 and sys.argv[1] == "validate":
+        validate()
+    else:
+        if len(sys.argv) > 1:
+            build(cell_size=int(sys.argv[1]))
+        else:
+            build()